@@ -1,14 +1,16 @@
 import itertools
 import logging
 from pathlib import Path
-from typing import Any, ClassVar, cast
+from typing import Any, ClassVar, TextIO, cast
 
 import settings
 from BaseClasses import CollectionState, Item, Location, MultiWorld, Tutorial
 from Fill import fill_restrictive
-from Options import Option, OptionError
+from Options import Option
 from worlds.AutoWorld import WebWorld, World
+from worlds.generic.Rules import ItemRule, add_item_rule
 
+from .budget import check_pool_budget, get_keyzers, get_pool_budget
 from .client import WL4Client as WL4Client  # Suppress unused import warning
 from .data import Passage, data_path
 from .items import (
@@ -16,6 +18,8 @@ from .items import (
     WL4EventItem,
     WL4Item,
     ability_table,
+    allow_items,
+    allowed_item_rule,
     cd_table,
     get_jewel_pieces_by_passage,
     golden_treasure_table,
@@ -23,11 +27,23 @@ from .items import (
     jewel_piece_table,
     keyzer_table,
 )
-from .locations import WL4Location, get_level_locations, location_name_to_id
-from .options import Goal, OpenDoors, WL4Options, wl4_option_groups
+from .locations import get_level_locations, location_name_to_id
+from .options import Goal, WL4Options, wl4_option_groups
+from .profiling import (
+    RuleProfiler,
+    Telemetry,
+    get_profile_path,
+    get_telemetry_path,
+    span,
+    telemetry_span,
+    write_rule_profiles,
+    write_telemetry,
+)
 from .region_data import passage_levels
 from .regions import WL4Level, connect_regions, create_regions
-from .rom import MD5_JP, MD5_US_EU, WL4ProcedurePatch, write_tokens
+from .rom import MD5_JP, MD5_US_EU, WL4ProcedurePatch, map_rom, write_tokens
+from .rules import RuleIndex, inventory_layout, update_counters
+from .tricks import get_enabled_tricks
 
 
 class WL4Settings(settings.Group):
@@ -37,6 +53,12 @@ class WL4Settings(settings.Group):
         copy_to = "Wario Land 4.gba"
         md5s = [MD5_US_EU, MD5_JP]
 
+        @classmethod
+        def validate(cls, path: str) -> None:
+            with map_rom(Path(path)) as rom:
+                if rom.md5 not in cls.md5s:
+                    raise ValueError(f"File hash does not match for {path}")
+
     rom_file: RomFile = RomFile(RomFile.copy_to)
     rom_start: bool = True
 
@@ -133,16 +155,28 @@ class WL4World(World):
 
     filler_item_weights: tuple[int, int, int] | None
 
+    rule_index: RuleIndex
+    enabled_tricks: frozenset[str]
+    rule_profiler: RuleProfiler | None
+    telemetry: Telemetry | None
+
     def __init__(self, *args, **kwargs):
         super(WL4World, self).__init__(*args, **kwargs)
         self.filler_item_weights = None
+        self.rule_index = RuleIndex(self.player)
+        self.enabled_tricks = frozenset()
+        self.rule_profiler = None
+        self.telemetry = Telemetry() if get_telemetry_path() is not None else None
 
     levels: dict[str, WL4Level]
 
+    @telemetry_span("generate_early")
     def generate_early(self):
         if self.is_universal_tracker():
             self.set_options_from_slot_data()
 
+        self.enabled_tricks = get_enabled_tricks(self.options)
+
         if self.options.goal in (Goal.option_local_golden_treasure_hunt, Goal.option_local_golden_diva_treasure_hunt):
             self.options.local_items.value.update(self.item_name_groups["Golden Treasure"])
         if self.options.required_jewels > self.options.pool_jewels:
@@ -157,106 +191,47 @@ class WL4World(World):
                             "Jewels to 1.")
             self.options.golden_jewels.value = 1
 
-        # TODO: Make this more tolerant when start inventory from pool is involved?
-        abilities = 8
-        full_health_items = (9, 7, 6)[self.options.difficulty.value]
-        rando_jewel_pieces = 4 * (min(self.options.pool_jewels.value, 1) +  # Entry
-                                  4 * self.options.pool_jewels.value +  # Emerald, Ruby, Topaz, Sapphire
-                                  self.options.golden_jewels.value)  # Golden Pyramid
-        vanilla_jewel_pieces = 4 * 18
-        if (rando_jewel_pieces + abilities - vanilla_jewel_pieces > full_health_items and
-            not self.options.diamond_shuffle.value):
-            raise OptionError(f"Not enough locations to place abilities for {self.player_name}. "
-                              'Set the "Pool Jewels" or "Golden Jewels" option to a lower value and try again.')
-
         self.filler_item_weights = self.options.prize_weight.value, self.options.junk_weight.value, self.options.trap_weight.value
 
         self.levels = {}
 
+        # TODO: Make this more tolerant when start inventory from pool is involved?
+        check_pool_budget(self)
+
+    @telemetry_span("create_regions")
     def create_regions(self):
         create_regions(self)
         connect_regions(self)
 
-    def create_items(self):
-        difficulty = self.options.difficulty.value
-        treasure_hunt = self.options.goal.needs_treasure_hunt()
-        diamond_shuffle = self.options.diamond_shuffle.value
+        if self.telemetry is not None:
+            regions = self.multiworld.get_regions(self.player)
+            self.telemetry.count("regions", len(regions))
+            self.telemetry.count("entrances", sum(len(region.exits) for region in regions))
+            self.telemetry.count("locations", sum(len(region.locations) for region in regions))
 
-        vanilla_jewel_pieces = 18 * 4
-        cds = 16
-        full_health_items = (9, 7, 6)[difficulty]
-        treasures = 12 * treasure_hunt
-        diamonds = diamond_shuffle * (109, 71, 68)[difficulty]
-        total_required_locations = vanilla_jewel_pieces + cds + full_health_items + treasures + diamonds
+    @telemetry_span("create_items")
+    def create_items(self):
+        budget = get_pool_budget(self)
+        required_jewels = self.options.required_jewels.value
 
         itempool = []
-
-        required_jewels = self.options.required_jewels.value
-        pool_jewels = self.options.pool_jewels.value
-        for name, item in jewel_piece_table.items():
-            force_non_progression = required_jewels == 0
-            if item.passage == Passage.ENTRY:
-                copies = min(pool_jewels, 1)
-            elif item.passage == Passage.GOLDEN:
-                copies = self.options.golden_jewels.value
-                if self.options.goal.is_treasure_hunt():
+        for name, count in budget.items.items():
+            force_non_progression = False
+            if name in jewel_piece_table:
+                force_non_progression = required_jewels == 0
+                if jewel_piece_table[name].passage == Passage.GOLDEN and self.options.goal.is_treasure_hunt():
                     force_non_progression = True
-            else:
-                copies = pool_jewels
-
-            itempool += [self.create_item(name, force_non_progression) for _ in range(copies)]
-
-        itempool += [self.create_item(name) for name in cd_table]
-
-        for name in ability_table:
-            itempool.append(self.create_item(name))
-            if name.startswith("Progressive"):
-                itempool.append(self.create_item(name))
-
-        # Remove diamonds or full health items to make space for abilities
-        abilities = 8
-        total_rando_jewel_pieces = 4 * (min(self.options.pool_jewels.value, 1) +  # Entry
-                                        4 * self.options.pool_jewels.value +  # Emerald, Ruby, Topaz, Sapphire
-                                        self.options.golden_jewels.value)  # Golden Pyramid
-        extra_items = total_rando_jewel_pieces + abilities - vanilla_jewel_pieces
-        if extra_items > 0:
-            if diamond_shuffle:
-                diamonds -= extra_items
-            else:
-                full_health_items -= extra_items
-        assert diamonds >= 0 and full_health_items >= 0
-
-        itempool += [self.create_item("Full Health Item") for _ in range(full_health_items)]
-
-        if treasure_hunt:
-            itempool += [self.create_item(name) for name in golden_treasure_table]
-
-        if diamond_shuffle:
-            itempool += [self.create_item("Diamond") for _ in range(diamonds)]
-
-        keyzers_in_levels: dict[str, KeyzerItemData]
-        starting_keyzers: list[str]
-        match self.options.open_doors.value:
-            case OpenDoors.option_off:
-                keyzers_in_levels = dict(keyzer_table)
-                starting_keyzers = []
-            case OpenDoors.option_closed_diva:
-                gp_keyzer = "Keyzer (Golden Pyramid Boss)"
-                keyzers_in_levels = {gp_keyzer: keyzer_table[gp_keyzer]}
-                starting_keyzers = [keyzer for keyzer in keyzer_table.keys() if keyzer != gp_keyzer]
-            case OpenDoors.option_open:
-                keyzers_in_levels = {}
-                starting_keyzers = list(keyzer_table.keys())
+            itempool += [self.create_item(name, force_non_progression) for _ in range(count)]
+
+        keyzers_in_levels, starting_keyzers = get_keyzers(self.options)
         assert keyzers_in_levels or starting_keyzers  # This assertion was written in blood
-        for name, data in keyzers_in_levels.items():
+        for name in keyzers_in_levels:
+            data = keyzer_table[name]
             self.levels[passage_levels[data.passage][data.level]].items.append(cast(WL4Item, self.create_item(name)))
         for name in starting_keyzers:
             self.multiworld.push_precollected(self.create_item(name))
-        if self.options.keyzer_shuffle.value:
-            total_required_locations += len(starting_keyzers)
 
-        junk_count = total_required_locations - len(itempool)
-        itempool += [self.create_item(self.get_filler_item_name()) for _ in range(junk_count)]
+        itempool += [self.create_item(self.get_filler_item_name()) for _ in range(budget.filler())]
 
         self.multiworld.itempool += itempool
 
@@ -265,88 +240,128 @@ class WL4World(World):
 
     @classmethod
     def stage_pre_fill(cls, multiworld: MultiWorld):
-        keyzers = set()
-        items: list[WL4Item] = []
-        locations: list[WL4Location] = []
-
+        worlds: dict[int, WL4World] = {}
         for world in multiworld.get_game_worlds(cls.game):
-            player = world.player
-            if player in multiworld.groups:
+            if world.player in multiworld.groups or not world.options.keyzer_shuffle.value:
                 continue
             assert type(world) is WL4World
+            worlds[world.player] = world
+        if not worlds:
+            return
 
-            if world.options.keyzer_shuffle.value:
-                for level in world.levels.values():
-                    keyzers.update((player, item.name) for item in level.items if type(item.data) is KeyzerItemData)
-                    items.extend(item for item in level.items if type(item.data) is KeyzerItemData)
-                    locations.extend(location for location in level.locations if not location.item)
-
-        if items:
-            def add_level_item_rule(location: WL4Location):
-                old_rule = location.item_rule
-                location.item_rule = lambda item: (
-                    old_rule(item)
-                    and (
-                        (item.player, item.name) not in keyzers
-                        or (
-                            type(item) is WL4Item
-                            and type(item.data) is KeyzerItemData
-                            and (item.data.passage, item.data.level) == (location.passage, location.level)
-                        )
-                    )
-                )
-
-            for location in locations:
-                add_level_item_rule(location)
-
-            multiworld.random.shuffle(locations)
-
-            shuffled_player_ids = {item.player for item in items}
-            all_state = CollectionState(multiworld)
-            for item in multiworld.itempool:
-                multiworld.worlds[item.player].collect(all_state, item)
-            prefill_items: list[Item] = []
-            for player in shuffled_player_ids:
-                prefill_items.extend(multiworld.worlds[player].get_pre_fill_items())
-            for item in items:
-                prefill_items.remove(item)
-            for item in prefill_items:
-                multiworld.worlds[item.player].collect(all_state, item)
-            all_state.sweep_for_advancements()
-
-            for player in shuffled_player_ids:
-                if all_state.has("Escape the Pyramid", player):
-                    all_state.remove(WL4EventItem("Escape the Pyramid", player))
-
-            for player in shuffled_player_ids:
-                local_items = [cast(Item, item) for item in items if item.player == player]
-                local_locations = [cast(Location, loc) for loc in locations if loc.player == player]
-                multiworld.random.shuffle(local_locations)
-                fill_restrictive(
-                    multiworld,
-                    all_state,
-                    local_locations,
-                    local_items,
-                    lock=True,
-                    single_player_placement=True,
-                    allow_excluded=True,
-                    allow_partial=False,
-                    name="WL4 Keyzers",
-                )
+        # Level locations only check their own player's items, so the other players' items can be left out. All the
+        # shuffled players share one state, which keeps each player's items apart anyway.
+        state = CollectionState(multiworld)
+        for item in multiworld.itempool:
+            if item.player in worlds:
+                worlds[item.player].collect(state, item)
+        for world in worlds.values():
+            for item in world.get_pre_fill_items():
+                if type(item.data) is not KeyzerItemData:
+                    world.collect(state, item)
+
+        for world in worlds.values():
+            with span(world.telemetry, "stage_pre_fill"):
+                world.place_keyzers(state)
+
+    def place_keyzers(self, state: CollectionState):
+        """
+        Put each of this world's keyzers in a random location of its own level. Levels are
+        visited in passage order, so a level's locations only have to be reachable with the
+        keyzers placed before it. If a level has too few reachable locations, the keyzers
+        left go through fill_restrictive instead.
+        """
+
+        player = self.player
+        events = [
+            location for location in self.multiworld.get_locations(player)
+            if location.item is not None and location.item.advancement and location.address is None
+        ]
+
+        for level_name in itertools.chain.from_iterable(passage_levels.values()):
+            level = self.levels[level_name]
+            level_keyzers = [item for item in level.items if type(item.data) is KeyzerItemData]
+            if not level_keyzers:
+                continue
+
+            state.sweep_for_advancements(events)
+            candidates = [
+                location for location in level.locations
+                if location.item is None and location.can_fill(state, level_keyzers[0], True)
+            ]
+            if len(candidates) < len(level_keyzers):
+                self.fill_remaining_keyzers(state)
+                return
+
+            for item, location in zip(level_keyzers, self.random.sample(candidates, len(level_keyzers))):
+                location.place_locked_item(item)
+                state.collect(item, True, location)
+
+    def fill_remaining_keyzers(self, state: CollectionState):
+        items: list[Item] = []
+        old_rules: dict[Location, ItemRule] = {}
+        for level in self.levels.values():
+            keyzers = [item for item in level.items if type(item.data) is KeyzerItemData]
+            items.extend(item for item in keyzers if item.location is None)
+            only_keyzers = allowed_item_rule(self.player, allow_items((item.name for item in keyzers), foreign=False))
+            for location in level.locations:
+                if location.item is None:
+                    # Keep whatever rules other steps added, like local and non-local items
+                    old_rules[location] = location.item_rule
+                    add_item_rule(location, only_keyzers)
+
+        if state.has("Escape the Pyramid", self.player):
+            state.remove(WL4EventItem("Escape the Pyramid", self.player))
+        locations: list[Location] = list(old_rules)
+        self.random.shuffle(locations)
+        fill_restrictive(
+            self.multiworld,
+            state,
+            locations,
+            items,
+            lock=True,
+            single_player_placement=True,
+            allow_excluded=True,
+            allow_partial=False,
+            name="WL4 Keyzers",
+        )
+
+        for location, item_rule in old_rules.items():
+            location.item_rule = item_rule
 
     def generate_output(self, output_directory: str):
         output_path = Path(output_directory)
 
         patch = WL4ProcedurePatch(player=self.player, player_name=self.player_name)
         patch.write_file("basepatch.bsdiff", data_path("basepatch.bsdiff"))
-        write_tokens(self, patch)
+        with span(self.telemetry, "write_tokens"):
+            write_tokens(self, patch)
         patch.procedure.append((
             "shuffle_music_and_wario_voice",
             [self.options.music_shuffle.value, self.options.wario_voice_shuffle.value]
         ))
 
         output_filename = self.multiworld.get_out_file_name_base(self.player)
-        patch.write(str((output_path / output_filename).with_suffix(patch.patch_file_ending)))
+        with span(self.telemetry, "write_patch"):
+            patch.write(str((output_path / output_filename).with_suffix(patch.patch_file_ending)))
+
+        telemetry_path = get_telemetry_path()
+        if self.telemetry is not None and telemetry_path is not None:
+            self.telemetry.count("tokens", patch.token_count)
+            write_telemetry(telemetry_path, self, self.telemetry)
+
+    @classmethod
+    def stage_generate_output(cls, multiworld: MultiWorld, output_directory: str):
+        profile_path = get_profile_path()
+        if profile_path is not None:
+            write_rule_profiles(profile_path, multiworld.get_game_worlds(cls.game))
+
+    @classmethod
+    def stage_write_spoiler(cls, multiworld: MultiWorld, spoiler_handle: TextIO):
+        # The playthrough checks rules again after the output is written, so add those calls to the report
+        profile_path = get_profile_path()
+        if profile_path is not None:
+            write_rule_profiles(profile_path, multiworld.get_game_worlds(cls.game))
 
     def fill_slot_data(self) -> dict[str, Any]:
         return self.options.as_dict(
@@ -354,6 +369,8 @@ class WL4World(World):
             "golden_treasure_count",
             "difficulty",
             "logic",
+            "enabled_tricks",
+            "disabled_tricks",
             "required_jewels",
             "open_doors",
             "keyzer_shuffle",
@@ -373,7 +390,26 @@ class WL4World(World):
             return WL4EventItem(name, self.player)
         return WL4Item(name, self.player, force_non_progression)
 
+    def collect(self, state: CollectionState, item: Item) -> bool:
+        changed = super().collect(state, item)
+        if changed:
+            inventory_layout.update(state, self.player, item.name)
+            update_counters(state, self.player, item.name)
+            self.rule_index.invalidate(state, item.name)
+        return changed
+
+    def remove(self, state: CollectionState, item: Item) -> bool:
+        changed = super().remove(state, item)
+        if changed:
+            inventory_layout.update(state, self.player, item.name)
+            update_counters(state, self.player, item.name)
+            self.rule_index.invalidate(state, item.name)
+        return changed
+
     def set_rules(self):
+        if get_profile_path() is not None:
+            self.rule_profiler = RuleProfiler()
+        self.rule_index.bind(self, self.rule_profiler)
         self.multiworld.completion_condition[self.player] = (
             lambda state: state.has("Escape the Pyramid", self.player))
 
@@ -406,8 +442,14 @@ class WL4World(World):
         set_option("golden_treasure_count")
         set_option("difficulty")
         set_option("logic")
+        set_option("enabled_tricks")
+        set_option("disabled_tricks")
         set_option("required_jewels")
         set_option("open_doors")
         set_option("keyzer_shuffle")
         set_option("portal")
         set_option("diamond_shuffle")
+
+
+# Universal Tracker collects this to put out of logic locations in logic
+inventory_layout.add(WL4World.glitches_item_name)
@@ -0,0 +1,204 @@
+"""
+Reachability tables for levels.
+
+Inside a level, whether a location or exit is reachable depends only on a
+handful of items, mostly Wario's abilities, and which tricks are in logic. That's
+few enough combinations to try them all, so a level's logic can be stored as one
+bitset per spot, with a bit for every combination it's reachable with.
+
+The tables for every difficulty and portal setting are shipped in
+data/level_tables.json. After changing region_data.py or tricks.py, rebuild them
+from the Archipelago directory with `python -m worlds.wl4.ability_tables`.
+"""
+
+from __future__ import annotations
+
+import functools
+import itertools
+import json
+from typing import Iterable, NamedTuple, TYPE_CHECKING
+
+from .data import data_path
+from .rules import All, Any, Difficulty, Has, Requirement, Trick, advanced_logic, all_of, any_of, has
+
+if TYPE_CHECKING:
+    from .regions import EntranceTemplate, RegionTemplate
+
+
+LEVEL_TABLES_FILE = "level_tables.json"
+
+
+class LevelTable(NamedTuple):
+    items: tuple[tuple[str, int], ...]  # Each item the level checks and the most of it any rule needs
+    tricks: tuple[str | None, ...]  # Each trick the level checks
+    spots: dict[str, int]  # Location or entrance name -> bitset of the states it's reachable in
+
+    def states(self) -> Iterable[tuple[int, ...]]:
+        """Every combination of item counts and tricks, in bit order."""
+        return itertools.product(*(range(count + 1) for _, count in self.items), *((0, 1) for _ in self.tricks))
+
+
+def fold_difficulty(requirement: Requirement, difficulty: int) -> Requirement:
+    """Resolve the difficulty checks in a requirement, keeping the tricks."""
+    if type(requirement) is All:
+        return all_of(*(fold_difficulty(child, difficulty) for child in requirement.children))
+    if type(requirement) is Any:
+        return any_of(*(fold_difficulty(child, difficulty) for child in requirement.children))
+    if type(requirement) is Difficulty:
+        return all_of() if difficulty in requirement.difficulties else any_of()
+    return requirement
+
+
+def _leaves(requirement: Requirement, items: dict[str, int], tricks: set[str | None]):
+    if type(requirement) is Has:
+        items[requirement.item] = max(items.get(requirement.item, 0), requirement.count)
+    elif type(requirement) is Trick:
+        tricks.add(requirement.name)
+    elif type(requirement) is All or type(requirement) is Any:
+        for child in requirement.children:
+            _leaves(child, items, tricks)
+    else:
+        raise TypeError(f"Can't build a table for {type(requirement).__name__}")
+
+
+def _evaluate(requirement: Requirement, inventory: dict[str, int], tricks: set[str | None]) -> bool:
+    if type(requirement) is Has:
+        return inventory.get(requirement.item, 0) >= requirement.count
+    if type(requirement) is Trick:
+        return requirement.name in tricks
+    if type(requirement) is All:
+        return all(_evaluate(child, inventory, tricks) for child in requirement.children)
+    return any(_evaluate(child, inventory, tricks) for child in requirement.children)
+
+
+def create_level_table(regions: list[RegionTemplate], entrances: list[EntranceTemplate], start: str) -> LevelTable:
+    """
+    Find what's reachable from `start` in every state, given the level's regions
+    and the entrances between them. Events placed in the level are collected as
+    they're reached, so they aren't part of the states.
+    """
+
+    events = {location.event for region in regions for location in region.locations if location.event is not None}
+    item_counts = {}
+    trick_names = set()
+    for requirement in itertools.chain((location.requirement for region in regions for location in region.locations),
+                                       (entrance.requirement for entrance in entrances)):
+        _leaves(requirement, item_counts, trick_names)
+    items = tuple(sorted((item, count) for item, count in item_counts.items() if item not in events))
+    tricks = tuple(sorted(trick_names, key=lambda name: name or ""))
+
+    table = LevelTable(items, tricks, {})
+    for spot in itertools.chain((location.name for region in regions for location in region.locations),
+                                (entrance.name for entrance in entrances)):
+        table.spots[spot] = 0
+
+    for index, state in enumerate(table.states()):
+        inventory = {item: count for (item, _), count in zip(items, state)}
+        enabled = {trick for trick, enabled in zip(tricks, state[len(items):]) if enabled}
+        while True:
+            reached = {start}
+            changed = True
+            while changed:
+                changed = False
+                for entrance in entrances:
+                    if (entrance.source in reached and entrance.target not in reached
+                            and _evaluate(entrance.requirement, inventory, enabled)):
+                        reached.add(entrance.target)
+                        changed = True
+
+            collected = False
+            for region in regions:
+                if region.name not in reached:
+                    continue
+                for location in region.locations:
+                    if (location.event is not None and location.event not in inventory
+                            and _evaluate(location.requirement, inventory, enabled)):
+                        inventory[location.event] = 1
+                        collected = True
+            if not collected:
+                break
+
+        for region in regions:
+            if region.name in reached:
+                for location in region.locations:
+                    if _evaluate(location.requirement, inventory, enabled):
+                        table.spots[location.name] |= 1 << index
+        for entrance in entrances:
+            if entrance.source in reached and _evaluate(entrance.requirement, inventory, enabled):
+                table.spots[entrance.name] |= 1 << index
+
+    return table
+
+
+def table_requirement(table: LevelTable, spot: str) -> Requirement:
+    """
+    Turn a spot's row of the table back into a requirement: any of the smallest
+    states it's reachable in. Rules only check for having items and tricks, so
+    having more never makes a spot unreachable, and those states are enough.
+    The result still has to be folded for a world.
+    """
+
+    reachable = table.spots[spot]
+    sizes = [count + 1 for _, count in table.items] + [2] * len(table.tricks)
+    strides = [1] * len(sizes)
+    for i in reversed(range(len(sizes) - 1)):
+        strides[i] = strides[i + 1] * sizes[i + 1]
+
+    minimal = []
+    for index, state in enumerate(table.states()):
+        if not reachable >> index & 1:
+            continue
+        if any(count > 0 and reachable >> (index - stride) & 1 for count, stride in zip(state, strides)):
+            continue
+        minimal.append(all_of(
+            *(has((item, count)) for (item, _), count in zip(table.items, state)),
+            *(advanced_logic(trick) for trick, enabled in zip(table.tricks, state[len(table.items):]) if enabled),
+        ))
+    return any_of(*minimal)
+
+
+def get_table_key(difficulty: int, portal: int):
+    return f"{difficulty},{portal}"
+
+
+def dump_level_tables(tables: dict[str, dict[str, LevelTable]]) -> str:
+    return json.dumps({
+        key: {
+            level_name: {
+                "items": table.items,
+                "tricks": table.tricks,
+                "spots": {spot: hex(reachable) for spot, reachable in table.spots.items()},
+            }
+            for level_name, table in levels.items()
+        }
+        for key, levels in tables.items()
+    }, indent=1, sort_keys=True)
+
+
+def parse_level_tables(data: str) -> dict[str, dict[str, LevelTable]]:
+    return {
+        key: {
+            level_name: LevelTable(
+                tuple((item, count) for item, count in table["items"]),
+                tuple(table["tricks"]),
+                {spot: int(reachable, 16) for spot, reachable in table["spots"].items()},
+            )
+            for level_name, table in levels.items()
+        }
+        for key, levels in json.loads(data).items()
+    }
+
+
+@functools.cache
+def load_level_tables() -> dict[str, dict[str, LevelTable]]:
+    return parse_level_tables(data_path(LEVEL_TABLES_FILE).decode("utf-8"))
+
+
+if __name__ == "__main__":
+    from pathlib import Path
+
+    from .regions import create_level_tables
+
+    with open(Path(__file__).parent / "data" / LEVEL_TABLES_FILE, "w", encoding="utf-8") as file:
+        file.write(dump_level_tables(create_level_tables()))
+        file.write("\n")
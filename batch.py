@@ -0,0 +1,181 @@
+"""
+Evaluate a world's logic for many inventories at once.
+
+Each row of an inventory matrix is one collection state, and each column is the
+count of one item. `evaluate` returns which regions, entrances, and locations
+are reachable in every row, sweeping for the world's own events and placed
+advancement items the same way `CollectionState.sweep_for_advancements` would.
+
+This module needs NumPy, which isn't a dependency of the world itself, so it
+isn't imported anywhere during generation.
+"""
+
+from __future__ import annotations
+
+from typing import Iterable, NamedTuple, Sequence, TYPE_CHECKING
+
+import numpy as np
+
+from BaseClasses import Entrance, Location, Region
+
+from .rules import All, Any, Has, Jewels, Requirement, TRUE, Treasures
+from .items import get_jewel_pieces_by_passage, golden_treasure_table
+
+if TYPE_CHECKING:
+    from . import WL4World
+
+
+class BatchResult(NamedTuple):
+    regions: list[Region]
+    entrances: list[Entrance]
+    locations: list[Location]
+    region_reachable: np.ndarray  # states x regions
+    entrance_reachable: np.ndarray  # states x entrances
+    location_reachable: np.ndarray  # states x locations
+
+    def can_reach_region(self, name: str) -> np.ndarray:
+        return self.region_reachable[:, [region.name for region in self.regions].index(name)]
+
+    def can_reach_entrance(self, name: str) -> np.ndarray:
+        return self.entrance_reachable[:, [entrance.name for entrance in self.entrances].index(name)]
+
+    def can_reach_location(self, name: str) -> np.ndarray:
+        return self.location_reachable[:, [location.name for location in self.locations].index(name)]
+
+
+def make_inventories(inventories: Iterable[Iterable[str]]) -> tuple[np.ndarray, list[str]]:
+    """Build an inventory matrix from lists of item names, one list per state."""
+
+    inventories = [list(inventory) for inventory in inventories]
+    columns = sorted({item for inventory in inventories for item in inventory})
+    column_index = {item: i for i, item in enumerate(columns)}
+    matrix = np.zeros((len(inventories), len(columns)), dtype=np.int16)
+    for row, inventory in enumerate(inventories):
+        for item in inventory:
+            matrix[row, column_index[item]] += 1
+    return matrix, columns
+
+
+class _Evaluator:
+    world: WL4World
+    columns: dict[str, int]
+    counts: np.ndarray
+    cache: dict[int, np.ndarray]
+
+    def __init__(self, world: WL4World, columns: dict[str, int], counts: np.ndarray):
+        self.world = world
+        self.columns = columns
+        self.counts = counts
+        self.cache = {}
+
+    def column(self, item: str) -> np.ndarray:
+        index = self.columns.get(item)
+        if index is None:
+            return np.zeros(self.counts.shape[0], dtype=self.counts.dtype)
+        return self.counts[:, index]
+
+    def evaluate(self, rule: Requirement) -> np.ndarray:
+        result = self.cache.get(id(rule))
+        if result is not None:
+            return result
+
+        if type(rule) is Has:
+            result = self.column(rule.item) >= rule.count
+        elif type(rule) is All:
+            result = np.ones(self.counts.shape[0], dtype=bool)
+            for child in rule.children:
+                result = result & self.evaluate(child)
+        elif type(rule) is Any:
+            result = np.zeros(self.counts.shape[0], dtype=bool)
+            for child in rule.children:
+                result = result | self.evaluate(child)
+        elif type(rule) is Treasures:
+            held = sum((self.column(treasure) > 0).astype(np.int16) for treasure in golden_treasure_table)
+            result = held >= self.world.options.golden_treasure_count.value
+        elif type(rule) is Jewels:
+            jewels = np.minimum.reduce([self.column(piece) for piece in get_jewel_pieces_by_passage(rule.passage)])
+            result = jewels >= rule.count
+        else:
+            raise TypeError(f"{type(rule).__name__} should have been folded away")
+
+        self.cache[id(rule)] = result
+        return result
+
+
+def evaluate(world: WL4World,
+             inventories: np.ndarray,
+             items: Sequence[str],
+             start_regions: Sequence[str] | None = None,
+             sweep: bool = True,
+             include_precollected: bool = True) -> BatchResult:
+    """
+    Find what's reachable in `world` for every row of `inventories`, whose columns
+    are the counts of `items`. Reachability starts from `start_regions`, or the
+    world's origin region if not given.
+    """
+
+    multiworld = world.multiworld
+    player = world.player
+    regions = [region for region in multiworld.get_regions(player)]
+    entrances = [entrance for region in regions for entrance in region.exits]
+    locations = [location for region in regions for location in region.locations]
+    region_index = {region: i for i, region in enumerate(regions)}
+
+    requirements = world.rule_index.requirements
+    sweepable = [
+        (i, location.item.name)
+        for i, location in enumerate(locations)
+        if location.item is not None and location.item.player == player and location.item.advancement
+    ]
+
+    precollected = [item.name for item in multiworld.precollected_items[player]] if include_precollected else []
+    columns = {item: i for i, item in enumerate(items)}
+    for item in sorted({item for _, item in sweepable}.union(precollected) - columns.keys()):
+        columns[item] = len(columns)
+    base_counts = np.zeros((inventories.shape[0], len(columns)), dtype=np.int16)
+    base_counts[:, :len(items)] = inventories
+    for item in precollected:
+        base_counts[:, columns[item]] += 1
+
+    states = inventories.shape[0]
+    counts = base_counts
+    while True:
+        evaluator = _Evaluator(world, columns, counts)
+        entrance_rules = np.stack(
+            [evaluator.evaluate(requirements.get(entrance, TRUE)) for entrance in entrances], axis=1
+        ) if entrances else np.zeros((states, 0), dtype=bool)
+        location_rules = np.stack(
+            [evaluator.evaluate(requirements.get(location, TRUE)) for location in locations], axis=1
+        ) if locations else np.zeros((states, 0), dtype=bool)
+
+        region_reachable = np.zeros((states, len(regions)), dtype=bool)
+        for name in start_regions or (world.origin_region_name,):
+            region_reachable[:, region_index[world.get_region(name)]] = True
+        changed = True
+        while changed:
+            changed = False
+            for i, entrance in enumerate(entrances):
+                source = region_index[entrance.parent_region]
+                target = region_index[entrance.connected_region]
+                reached = region_reachable[:, source] & entrance_rules[:, i] & ~region_reachable[:, target]
+                if reached.any():
+                    region_reachable[:, target] |= reached
+                    changed = True
+
+        entrance_reachable = np.stack(
+            [region_reachable[:, region_index[entrance.parent_region]] for entrance in entrances], axis=1
+        ) & entrance_rules if entrances else entrance_rules
+        location_reachable = np.stack(
+            [region_reachable[:, region_index[location.parent_region]] for location in locations], axis=1
+        ) & location_rules if locations else location_rules
+
+        if not sweep:
+            break
+        new_counts = base_counts.copy()
+        for i, item in sweepable:
+            new_counts[:, columns[item]] += location_reachable[:, i]
+        if np.array_equal(new_counts, counts):
+            break
+        counts = new_counts
+
+    return BatchResult(regions, entrances, locations, region_reachable, entrance_reachable, location_reachable)
@@ -0,0 +1,108 @@
+"""
+Count the item pool a world's options make and the locations there will be
+for it, before generating anything. Options that need more locations than the
+world has are rejected in generate_early instead of failing in fill.
+"""
+
+from __future__ import annotations
+
+from typing import NamedTuple, TYPE_CHECKING
+
+from Options import OptionError
+
+from .data import Passage
+from .items import ability_table, cd_table, golden_treasure_table, jewel_piece_table, keyzer_table
+from .options import OpenDoors
+from .regions import get_world_template
+
+if TYPE_CHECKING:
+    from . import WL4World
+    from .options import WL4Options
+
+
+VANILLA_JEWEL_PIECES = 18 * 4
+
+
+class PoolBudget(NamedTuple):
+    locations: int  # Locations the item pool goes in, not counting those keyzers are locked in
+    items: dict[str, int]  # Each item in the pool other than filler and how many copies, in creation order
+
+    def filler(self) -> int:
+        return self.locations - sum(self.items.values())
+
+    def deficit(self) -> int:
+        return max(-self.filler(), 0)
+
+
+def get_keyzers(options: WL4Options) -> tuple[list[str], list[str]]:
+    """Split the keyzers into the ones placed in levels and the ones the player starts with."""
+    match options.open_doors.value:
+        case OpenDoors.option_off:
+            return list(keyzer_table), []
+        case OpenDoors.option_closed_diva:
+            gp_keyzer = "Keyzer (Golden Pyramid Boss)"
+            return [gp_keyzer], [keyzer for keyzer in keyzer_table if keyzer != gp_keyzer]
+        case OpenDoors.option_open:
+            return [], list(keyzer_table)
+    raise ValueError(f"Unknown Open Doors value {options.open_doors.value}")
+
+
+def count_pool_locations(world: WL4World) -> int:
+    template = get_world_template(world)
+    item_locations = {
+        location.name
+        for region in template.regions
+        for location in region.locations
+        if location.event is None and not location.force_event
+    }
+    locked = sum(f"{level} - Keyzer" in item_locations for level, _ in template.keyzers)
+    if world.options.keyzer_shuffle.value:
+        locked += len(get_keyzers(world.options)[0])
+    return len(item_locations) - locked
+
+
+def get_pool_budget(world: WL4World) -> PoolBudget:
+    options = world.options
+    difficulty = options.difficulty.value
+    pool_jewels = options.pool_jewels.value
+
+    items: dict[str, int] = {}
+    for name, item in jewel_piece_table.items():
+        if item.passage == Passage.ENTRY:
+            items[name] = min(pool_jewels, 1)
+        elif item.passage == Passage.GOLDEN:
+            items[name] = options.golden_jewels.value
+        else:
+            items[name] = pool_jewels
+    items.update(dict.fromkeys(cd_table, 1))
+    for name in ability_table:
+        items[name] = 2 if name.startswith("Progressive") else 1
+
+    # The pool replaces the vanilla jewel pieces, then takes diamonds or full health items to make space for the
+    # jewel pieces and abilities that don't fit
+    extra_items = sum(items.values()) - len(cd_table) - VANILLA_JEWEL_PIECES
+    full_health_items = (9, 7, 6)[difficulty]
+    diamonds = options.diamond_shuffle.value * (109, 71, 68)[difficulty]
+    if extra_items > 0:
+        if options.diamond_shuffle.value:
+            diamonds -= extra_items
+        else:
+            full_health_items -= extra_items
+
+    items["Full Health Item"] = max(full_health_items, 0)
+    if options.goal.needs_treasure_hunt():
+        items.update(dict.fromkeys(golden_treasure_table, 1))
+    items["Diamond"] = max(diamonds, 0)
+
+    return PoolBudget(count_pool_locations(world), {name: count for name, count in items.items() if count})
+
+
+def check_pool_budget(world: WL4World):
+    """Raise an OptionError if the world's item pool doesn't fit in its locations."""
+
+    budget = get_pool_budget(world)
+    if budget.deficit():
+        raise OptionError(f"Not enough locations to place abilities for {world.player_name}: the item pool needs "
+                          f"{budget.deficit()} more locations. "
+                          'Set the "Pool Jewels" or "Golden Jewels" option to a lower value and try again.')
+
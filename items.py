@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from enum import IntEnum
-from typing import Iterable, NamedTuple
+from typing import Callable, Iterable, NamedTuple
 
 from BaseClasses import Item, ItemClassification as IC
 
@@ -233,6 +233,37 @@ def get_jewel_pieces_by_passage(passage: Passage) -> Iterable[str]:
     return (name for name, data in jewel_piece_table.items() if data.passage == passage)
 
 
+class AllowedItems(NamedTuple):
+    items: int  # Bitset over the item IDs above of the items this world's own items can be
+    foreign: bool  # Whether other players' items are allowed
+
+
+ALL_ITEMS = AllowedItems((1 << 256) - 1, True)
+
+
+def allow_items(names: Iterable[str], foreign: bool = True) -> AllowedItems:
+    items = 0
+    for name in names:
+        items |= 1 << item_table[name].item_id()
+    return AllowedItems(items, foreign)
+
+
+def forbid_items(names: Iterable[str]) -> AllowedItems:
+    return AllowedItems(ALL_ITEMS.items & ~allow_items(names).items, True)
+
+
+def allowed_item_rule(player: int, allowed: AllowedItems) -> Callable[[Item], bool]:
+    items, foreign = allowed
+
+    def item_rule(item: Item):
+        if item.player != player:
+            return foreign
+        # Events have no ID and never go through fill
+        return item.code is not None and bool(items >> (item.code - ap_id_offset) & 1)
+
+    return item_rule
+
+
 class WL4ItemBase(Item):
     game: str = "Wario Land 4"
     data: ItemData | None
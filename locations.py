@@ -3,6 +3,7 @@ from typing import NamedTuple, Sequence
 from BaseClasses import Location, Region
 
 from .data import ItemFlag, Passage, ap_id_offset
+from .items import ALL_ITEMS, AllowedItems, allowed_item_rule
 from .options import Difficulty
 
 
@@ -390,6 +391,13 @@ class WL4Location(WL4LocationBase):
         super(WL4Location, self).__init__(player, name, None if force_event else location_name_to_id[name], parent)
         self.passage, self.level, self.flag, self.difficulty = location_table[name]
 
+    def set_allowed_items(self, allowed: AllowedItems):
+        """Replace the location's item rule with a single check against `allowed`."""
+        if allowed == ALL_ITEMS:
+            self.item_rule = Location.item_rule
+        else:
+            self.item_rule = allowed_item_rule(self.player, allowed)
+
     def entry_offset(self):
         return self.flag.bit_length() - 1
 
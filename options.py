@@ -5,12 +5,15 @@ from Options import (
     DeathLink,
     DefaultOnToggle,
     OptionGroup,
+    OptionSet,
     PerGameCommonOptions,
     Range,
     StartInventoryPool,
     Toggle,
 )
 
+from .trick_names import trick_categories, trick_names
+
 
 class Goal(Choice):
     """
@@ -76,6 +79,33 @@ class Logic(Choice):
     default = option_basic
 
 
+class EnabledTricks(OptionSet):
+    """
+    Strategies to put in logic regardless of the Logic option.
+    Accepts the names of individual tricks, or these categories:
+    Throws, Minion Jumps, Damage Boosts, Precise Movement
+    """
+    display_name = "Enabled Tricks"
+    valid_keys = trick_names | frozenset(trick_categories)
+
+
+class DisabledTricks(OptionSet):
+    """
+    Strategies to leave out of logic, even with advanced logic.
+    Accepts the same names and categories as Enabled Tricks, and takes priority over it.
+    """
+    display_name = "Disabled Tricks"
+    valid_keys = trick_names | frozenset(trick_categories)
+
+
+class CompactLogic(Toggle):
+    """
+    Collapse each level into a single region, with each location's rule looked up from a table of which of
+    Wario's abilities can reach it. Logic is exactly the same, but generation is faster with many players.
+    """
+    display_name = "Compact Logic"
+
+
 class PoolJewels(Range):
     """
     Number of jewels in the item pool per passage for the main four.
@@ -283,6 +313,9 @@ wl4_option_groups = [
 @dataclass
 class WL4Options(PerGameCommonOptions):
     logic: Logic
+    enabled_tricks: EnabledTricks
+    disabled_tricks: DisabledTricks
+    compact_logic: CompactLogic
     death_link: DeathLink
     goal: Goal
     golden_treasure_count: GoldenTreasureCount
@@ -0,0 +1,105 @@
+"""
+Patch every .apwl4 file in a directory at once, in a pool of processes.
+
+The base patch is applied once before the pool starts, which leaves its result
+in the cache directory. Every worker then copies its ROM straight from that
+file, mapped read-only, so the patched base ROM is shared between them through
+the page cache instead of being built once per file. Run it from the
+Archipelago directory:
+
+    python -m worlds.wl4.patcher path/to/patches [--output path/to/roms] [--jobs N]
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import NamedTuple
+
+from .rom import WL4PatchExtensions, WL4ProcedurePatch
+
+
+class PatchResult(NamedTuple):
+    source: Path
+    target: Path
+    time: float  # Seconds spent patching this file in its worker
+    error: str | None
+
+
+def find_patches(directory: Path) -> list[Path]:
+    return sorted(path for path in directory.iterdir() if path.suffix == WL4ProcedurePatch.patch_file_ending)
+
+
+def get_target_path(source: Path, output_directory: Path) -> Path:
+    return output_directory / source.with_suffix(WL4ProcedurePatch.result_file_ending).name
+
+
+def prepare_base_rom(source: Path):
+    """Apply one file's base patch, so the cache has the result before the workers need it."""
+    patch = WL4ProcedurePatch(path=str(source))
+    patch.read()
+    with WL4ProcedurePatch.get_source_data() as rom:
+        WL4PatchExtensions.apply_bsdiff4(patch, rom, "basepatch.bsdiff")
+
+
+def patch_file(source: Path, target: Path) -> PatchResult:
+    start = time.perf_counter()
+    try:
+        WL4ProcedurePatch(path=str(source)).patch(str(target))
+    except Exception as error:
+        return PatchResult(source, target, time.perf_counter() - start, f"{type(error).__name__}: {error}")
+    return PatchResult(source, target, time.perf_counter() - start, None)
+
+
+def patch_files(sources: list[Path], output_directory: Path, jobs: int) -> list[PatchResult]:
+    try:
+        prepare_base_rom(sources[0])
+    except Exception as error:
+        # Each worker applies the base patch itself instead, and reports its own errors
+        print(f"Couldn't prepare the base ROM from {sources[0].name}: {type(error).__name__}: {error}")
+    results = []
+    with ProcessPoolExecutor(jobs) as executor:
+        futures = [
+            executor.submit(patch_file, source, get_target_path(source, output_directory))
+            for source in sources
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            if result.error is None:
+                print(f"{result.time:8.3f} s  {result.source.name}")
+            else:
+                print(f"{result.time:8.3f} s  {result.source.name} failed: {result.error}")
+            results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Patch every Wario Land 4 patch file in a directory.")
+    parser.add_argument("directory", type=Path, help="Directory with the .apwl4 files to patch")
+    parser.add_argument("--output", type=Path, default=None,
+                        help="Directory to write the patched ROMs to (default: the patch directory)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Number of worker processes")
+    args = parser.parse_args()
+
+    sources = find_patches(args.directory)
+    if not sources:
+        print(f"No {WL4ProcedurePatch.patch_file_ending} files in {args.directory}")
+        sys.exit(1)
+    output_directory = args.output or args.directory
+    output_directory.mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    results = patch_files(sources, output_directory, args.jobs)
+    elapsed = time.perf_counter() - start
+
+    failed = sum(result.error is not None for result in results)
+    patched = len(results) - failed
+    print(f"Patched {patched} files in {elapsed:.2f} s ({patched / elapsed:.2f} files/s, "
+          f"{sum(result.time for result in results) / len(results):.3f} s per file in a worker)")
+    if failed:
+        print(f"{failed} files failed")
+        sys.exit(1)
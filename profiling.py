@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, ContextManager, Iterable, Iterator, TYPE_CHECKING, TypeVar, cast
+
+from BaseClasses import Entrance, Location
+
+if TYPE_CHECKING:
+    from . import WL4World
+    from .rules import Requirement
+
+
+# Set this to a file path to count and time every WL4 access rule during generation and write a report there
+PROFILE_ENVIRONMENT_VARIABLE = "WL4_RULE_PROFILE"
+
+
+# Set this to a file path to append each player's generation stage timings and counts there as JSON lines
+TELEMETRY_ENVIRONMENT_VARIABLE = "WL4_TELEMETRY"
+
+
+def get_profile_path() -> str | None:
+    return os.environ.get(PROFILE_ENVIRONMENT_VARIABLE) or None
+
+
+def get_telemetry_path() -> str | None:
+    return os.environ.get(TELEMETRY_ENVIRONMENT_VARIABLE) or None
+
+
+class RuleStats:
+    spot: str
+    requirement: str
+    hits: int  # Calls answered from the collection state's cached result
+    misses: int  # Calls that evaluated the compiled rule
+    true: int
+    time: float  # Seconds spent evaluating the compiled rule
+
+    def __init__(self, spot: str, requirement: str):
+        self.spot = spot
+        self.requirement = requirement
+        self.hits = 0
+        self.misses = 0
+        self.true = 0
+        self.time = 0
+
+
+class RuleProfiler:
+    """Counts calls, time, and results of the access rules of one world's locations and entrances."""
+
+    stats: list[RuleStats]
+
+    def __init__(self):
+        self.stats = []
+
+    def add(self, spot: Location | Entrance, requirement: Requirement) -> RuleStats:
+        # Only keep names, so the stats don't keep the multiworld alive
+        stats = RuleStats(spot.name, str(requirement))
+        self.stats.append(stats)
+        return stats
+
+    def report(self) -> str:
+        lines = [f"{'Hits':>10} {'Misses':>10} {'Miss ms':>10} {'True':>6}  {'Spot':<60}  Requirement"]
+        for stats in sorted(self.stats, key=lambda stats: stats.time, reverse=True):
+            calls = stats.hits + stats.misses
+            true_ratio = f"{stats.true / calls:.0%}" if calls else "-"
+            lines.append(
+                f"{stats.hits:>10} {stats.misses:>10} {stats.time * 1000:>10.2f} {true_ratio:>6}  "
+                f"{stats.spot:<60}  {stats.requirement}"
+            )
+        total_hits = sum(stats.hits for stats in self.stats)
+        total_misses = sum(stats.misses for stats in self.stats)
+        total_time = sum(stats.time for stats in self.stats)
+        lines.append(f"{total_hits:>10} {total_misses:>10} {total_time * 1000:>10.2f} {'':>6}  Total")
+        return "\n".join(lines)
+
+
+def write_rule_profiles(path: str, worlds: Iterable[WL4World]):
+    with open(path, "w", encoding="utf-8") as report:
+        for world in worlds:
+            if world.rule_profiler is not None:
+                report.write(f"{world.player_name} (player {world.player}, seed {world.multiworld.seed_name})\n")
+                report.write(world.rule_profiler.report())
+                report.write("\n\n")
+
+
+class Telemetry:
+    """Time spent in each generation stage of one world and counts of what it created."""
+
+    spans: dict[str, float]
+    counters: dict[str, int]
+
+    def __init__(self):
+        self.spans = {}
+        self.counters = {}
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[name] = self.spans.get(name, 0) + time.perf_counter() - start
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record(self, world: WL4World) -> dict[str, Any]:
+        return {
+            "game": world.game,
+            "seed": world.multiworld.seed_name,
+            "player": world.player,
+            "player_name": world.player_name,
+            "spans": self.spans,
+            "counters": self.counters,
+        }
+
+
+# Worlds write their output on different threads
+_telemetry_lock = threading.Lock()
+
+
+def write_telemetry(path: str, world: WL4World, telemetry: Telemetry):
+    line = json.dumps(telemetry.record(world))
+    with _telemetry_lock, open(path, "a", encoding="utf-8") as file:
+        file.write(line + "\n")
+
+
+def span(telemetry: Telemetry | None, name: str) -> ContextManager[None]:
+    return contextlib.nullcontext() if telemetry is None else telemetry.span(name)
+
+
+Method = TypeVar("Method", bound=Callable[..., Any])
+
+
+def telemetry_span(name: str) -> Callable[[Method], Method]:
+    """Time a method of WL4World as a telemetry span, if telemetry is on."""
+
+    def decorator(method: Method) -> Method:
+        @functools.wraps(method)
+        def wrapper(self: WL4World, *args, **kwargs):
+            with span(self.telemetry, name):
+                return method(self, *args, **kwargs)
+
+        return cast(Method, wrapper)
+
+    return decorator
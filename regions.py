@@ -1,16 +1,25 @@
 from __future__ import annotations
 
+import functools
 import itertools
-from typing import Iterable, TYPE_CHECKING
-
-from worlds.generic.Rules import CollectionRule, add_rule, add_item_rule
-from BaseClasses import Item, Region, Entrance
-
+from typing import Iterable, NamedTuple, TYPE_CHECKING
+
+from worlds.generic.Rules import CollectionRule
+from BaseClasses import Entrance, Region
+
+from .ability_tables import (
+    LevelTable,
+    create_level_table,
+    fold_difficulty,
+    get_table_key,
+    load_level_tables,
+    table_requirement,
+)
 from .data import Passage
-from .items import JewelPieceItemData, WL4EventItem, WL4Item, get_jewel_pieces_by_passage
+from .items import AllowedItems, WL4EventItem, WL4Item, forbid_items, get_jewel_pieces_by_passage
 from .locations import WL4EventLocation, WL4Location
 from .region_data import LocationData, LocationType, passage_levels, level_table, passage_boss_table, golden_diva
-from .rules import Requirement, has, has_all, has_treasures
+from .rules import TRUE, Requirement, all_difficulties, has, has_all, has_jewels, has_treasures, inventory_layout
 from .options import OpenDoors, Portal
 
 if TYPE_CHECKING:
@@ -48,6 +57,34 @@ def get_level_entrance_name(level: str):
     return f"{level} - Entrance" if level in level_table and level_table[level].use_entrance_region else level
 
 
+# Region name -> the level it's part of
+region_levels = {
+    get_region_name(level_name, region_data.name): level_name
+    for level_name, level_data in level_table.items()
+    for region_data in level_data.regions
+}
+
+
+def get_escape_event_name(level: str):
+    return f"Escape {level}"
+
+
+def get_event_names() -> Iterable[str]:
+    for level_name, level_data in level_table.items():
+        for region_data in level_data.regions:
+            for location_data in region_data.locations:
+                if location_data.type == LocationType.SWITCH:
+                    yield get_escape_event_name(level_name)
+    for passage in passage_boss_table:
+        yield f"{passage.long_name()} Clear"
+    yield "Escape the Pyramid"
+
+
+# Rules check events the same way they check items
+for event_name in get_event_names():
+    inventory_layout.add(event_name)
+
+
 def create_event(region: Region, location_name: str, item_name: str | None = None):
     if item_name is None:
         item_name = location_name
@@ -56,41 +93,98 @@ def create_event(region: Region, location_name: str, item_name: str | None = Non
     return location
 
 
-def create_regions(world: WL4World):
-    def can_escape(level) -> CollectionRule:
-        return lambda state: state.can_reach_location(f"{level} - Frog Switch", world.player)
-
-    def restrict_jewel_piece_on_boss(passage: Passage):
-        def rule(item: Item):
-            if item.player != world.player:
-                return True
-            assert type(item) is WL4Item
-            return type(item.data) is not JewelPieceItemData or item.data.passage != passage
-        return rule
-
-    def restrict_jewel_piece_in_golden_passage(item: Item):
-        if item.player != world.player:
-            return True
-        assert type(item) is WL4Item
-        return type(item.data) is not JewelPieceItemData or item.data.passage == Passage.GOLDEN
+class LocationTemplate(NamedTuple):
+    name: str
+    event: str | None  # The event locked at this location, if any
+    force_event: bool
+    level: str | None  # The level whose item locations this is part of, if it is one
+    requirement: Requirement  # Already folded
+    allowed_items: AllowedItems | None
+
+
+class RegionTemplate(NamedTuple):
+    name: str
+    locations: list[LocationTemplate]
+
+
+class EntranceTemplate(NamedTuple):
+    name: str
+    source: str
+    target: str
+    requirement: Requirement  # Already folded
+
+
+class WorldTemplate(NamedTuple):
+    """Every region, location, and entrance of a world, with folded requirements."""
+
+    regions: list[RegionTemplate]
+    entrances: list[EntranceTemplate]
+    keyzers: list[tuple[str, str]]  # Level and the keyzer locked in it
+
+
+# Worlds with the same logic-relevant options share a template for the whole process
+_world_templates: dict[tuple, WorldTemplate] = {}
+
+
+def get_template_key(world: WL4World) -> tuple:
+    options = world.options
+    return (
+        options.difficulty.value,
+        world.enabled_tricks,
+        options.logic.value,
+        options.goal.value,
+        options.required_jewels.value,
+        options.open_doors.value,
+        options.keyzer_shuffle.value,
+        options.portal.value,
+        options.diamond_shuffle.value,
+        options.restrict_self_locking_jewel_pieces.value,
+        options.compact_logic.value,
+        world.is_universal_tracker(),
+    )
+
+
+def get_world_template(world: WL4World) -> WorldTemplate:
+    key = get_template_key(world)
+    template = _world_templates.get(key)
+    if template is None:
+        template = _world_templates[key] = create_world_template(world)
+    return template
+
+
+@functools.cache
+def restrict_jewel_piece_on_boss(passage: Passage) -> AllowedItems:
+    return forbid_items(get_jewel_pieces_by_passage(passage))
+
+
+@functools.cache
+def restrict_jewel_piece_in_golden_passage() -> AllowedItems:
+    return forbid_items(
+        name for passage in Passage if passage != Passage.GOLDEN for name in get_jewel_pieces_by_passage(passage)
+    )
+
+
+def create_world_template(world: WL4World) -> WorldTemplate:
+    """Build the graph for a world's options. Only options in `get_template_key` may be used here."""
+
+    def location(name: str, *, event: str | None = None, force_event: bool = False, level: str | None = None,
+                 requirement: Requirement | None = None, allowed_items: AllowedItems | None = None):
+        folded = TRUE if requirement is None else requirement.fold(world)
+        return LocationTemplate(name, event, force_event, level, folded, allowed_items)
 
     difficulty = world.options.difficulty.value
 
     regions = []
 
-    pyramid = WL4Region("Pyramid", world)
+    pyramid = RegionTemplate("Pyramid", [])
     regions.append(pyramid)
 
     for passage in Passage:
-        regions.append(WL4Region(passage.long_name(), world))
+        regions.append(RegionTemplate(passage.long_name(), []))
 
     for level_name, level_data in level_table.items():
-        level = WL4Level(world)
-        world.levels[level_name] = level
-
         for region_data in level_data.regions:
-            region_name = get_region_name(level_name, region_data.name)
-            region = WL4Region(region_name, world)
+            region = RegionTemplate(get_region_name(level_name, region_data.name), [])
 
             locations = filter(lambda location: difficulty in location.difficulties, region_data.locations)
             if not world.options.diamond_shuffle.value:
@@ -109,86 +203,222 @@ def create_regions(world: WL4World):
                     if level_name != "Golden Passage":
                         continue
 
+                requirement = location_data.access_rule
+                if world.options.portal.value == Portal.option_vanilla and location_data.type != LocationType.SWITCH:
+                    escape = has(get_escape_event_name(level_name))
+                    requirement = escape if requirement is None else requirement & escape
+                allowed_items = None
+                if world.options.restrict_self_locking_jewel_pieces.value and level_name == "Golden Passage":
+                    allowed_items = restrict_jewel_piece_in_golden_passage()
+
                 location_name = f"{level_name} - {location_data.name}"
                 if location_data.type == LocationType.SWITCH:
-                    item_name = f"{location_data.name} ({level_name})"
-                    location = create_event(region, location_name, item_name)
+                    event = get_escape_event_name(level_name)
+                    region.locations.append(
+                        location(location_name, event=event, requirement=requirement)
+                    )
                 elif location_data.type == LocationType.KEYZER and not world.options.keyzer_shuffle.value:
-                    location = WL4Location(world.player, location_name, region, force_event=True)
+                    region.locations.append(
+                        location(location_name, force_event=True, requirement=requirement, allowed_items=allowed_items)
+                    )
                 else:
-                    location = WL4Location(world.player, location_name, region)
-                    level.locations.append(location)
-
-                if location_data.access_rule is not None:
-                    add_rule(location, location_data.access_rule.apply_world(world))
-                if world.options.portal.value == Portal.option_vanilla and location_data.type != LocationType.SWITCH:
-                    add_rule(location, can_escape(level_name))
-                if world.options.restrict_self_locking_jewel_pieces.value and level_name == "Golden Passage":
-                    add_item_rule(location, restrict_jewel_piece_in_golden_passage)
-
-                region.locations.append(location)
+                    region.locations.append(
+                        location(location_name, level=level_name, requirement=requirement, allowed_items=allowed_items)
+                    )
             regions.append(region)
 
     for passage, boss_data in passage_boss_table.items():
-        boss_region = WL4Region(f"{passage.long_name()} Boss", world)
-        location = create_event(boss_region, boss_data.name, f"{passage.long_name()} Clear")
-        add_rule(location, boss_data.kill_rule.apply_world(world))
-        boss_region.locations.append(location)
+        boss_region = RegionTemplate(f"{passage.long_name()} Boss", [])
+        boss_region.locations.append(
+            location(boss_data.name, event=f"{passage.long_name()} Clear", requirement=boss_data.kill_rule)
+        )
         regions.append(boss_region)
 
         if world.options.goal.needs_treasure_hunt():
-            prize_region = WL4Region(f"{boss_data.name} - Prizes", world)
+            prize_region = RegionTemplate(f"{boss_data.name} - Prizes", [])
+            allowed_items = None
+            if world.options.restrict_self_locking_jewel_pieces.value:
+                allowed_items = restrict_jewel_piece_on_boss(passage)
             for time in ("15", "35", "55"):
-                location = WL4Location(world.player, f"{boss_data.name} - 0:{time}", prize_region)
-                if world.options.restrict_self_locking_jewel_pieces.value:
-                    add_item_rule(location, restrict_jewel_piece_on_boss(passage))
-                prize_region.locations.append(location)
+                prize_region.locations.append(location(f"{boss_data.name} - 0:{time}", allowed_items=allowed_items))
             regions.append(prize_region)
 
-    golden_diva_region = WL4Region("Golden Pyramid Boss", world)
+    golden_diva_region = RegionTemplate("Golden Pyramid Boss", [])
     if world.options.goal.needs_diva():
-        diva_location = create_event(golden_diva_region, golden_diva.name, "Escape the Pyramid")
-        golden_diva_region.locations.append(diva_location)
-        add_rule(diva_location, golden_diva.kill_rule.apply_world(world))
+        kill_rule = golden_diva.kill_rule
         if (world.options.goal.needs_treasure_hunt()):
-            add_rule(diva_location, has_treasures().apply_world(world))
+            kill_rule = kill_rule & has_treasures()
+        golden_diva_region.locations.append(
+            location(golden_diva.name, event="Escape the Pyramid", requirement=kill_rule)
+        )
     regions.append(golden_diva_region)
 
     if world.options.goal.is_treasure_hunt():
-        emergency_exit = create_event(pyramid, "Sound Room Emergency Exit", "Escape the Pyramid")
-        emergency_exit.access_rule = has_treasures().apply_world(world)
-        pyramid.locations.append(emergency_exit)
+        pyramid.locations.append(
+            location("Sound Room Emergency Exit", event="Escape the Pyramid", requirement=has_treasures())
+        )
+
+    entrances, keyzers = create_entrance_templates(world)
+    template = WorldTemplate(regions, entrances, keyzers)
+    if world.options.compact_logic.value:
+        template = compact_world_template(template, world)
+    else:
+        template = merge_open_regions(template)
+    return template
+
+
+def merge_open_regions(template: WorldTemplate) -> WorldTemplate:
+    """
+    Merge each region inside a level into the region before it if that's the only way in and it's always open,
+    since then both are reachable in exactly the same states. Level entrances and everything outside levels keep
+    their regions, so entrances from elsewhere still have somewhere to go.
+    """
+
+    incoming: dict[str, list[EntranceTemplate]] = {}
+    for entrance in template.entrances:
+        incoming.setdefault(entrance.target, []).append(entrance)
+
+    merged_into: dict[str, str] = {}
+
+    def merged_region(region_name: str):
+        while region_name in merged_into:
+            region_name = merged_into[region_name]
+        return region_name
+
+    for region in template.regions:
+        level_name = region_levels.get(region.name)
+        if level_name is None or region.name == get_level_entrance_name(level_name):
+            continue
+        entrances = incoming.get(region.name, [])
+        if (len(entrances) == 1 and entrances[0].requirement is TRUE
+                and merged_region(entrances[0].source) != region.name):
+            merged_into[region.name] = entrances[0].source
+
+    regions: dict[str, RegionTemplate] = {}
+    for region in template.regions:
+        target = merged_region(region.name)
+        if target == region.name:
+            regions[region.name] = RegionTemplate(region.name, list(region.locations))
+    for region in template.regions:
+        target = merged_region(region.name)
+        if target != region.name:
+            regions[target].locations.extend(region.locations)
+
+    entrances = [
+        entrance._replace(source=merged_region(entrance.source))
+        for entrance in template.entrances
+        if entrance.target not in merged_into
+    ]
+    return template._replace(regions=list(regions.values()), entrances=entrances)
+
+
+def compact_world_template(template: WorldTemplate, world: WL4World) -> WorldTemplate:
+    """Replace the regions inside each level with one region whose location rules come from the level's table."""
+
+    tables = load_level_tables()[get_table_key(world.options.difficulty.value, world.options.portal.value)]
+
+    def level_region(region_name: str):
+        level_name = region_levels.get(region_name)
+        return region_name if level_name is None else get_level_entrance_name(level_name)
+
+    level_regions: dict[str, list[RegionTemplate]] = {}
+    entrances = []
+    for entrance in template.entrances:
+        level_name = region_levels.get(entrance.source)
+        if level_name is None or region_levels.get(entrance.target) != level_name:
+            entrances.append(entrance._replace(source=level_region(entrance.source),
+                                               target=level_region(entrance.target)))
+
+    regions = []
+    for region in template.regions:
+        level_name = region_levels.get(region.name)
+        if level_name is None:
+            regions.append(region)
+            continue
+        if level_name not in level_regions:
+            level_regions[level_name] = []
+            regions.append(RegionTemplate(get_level_entrance_name(level_name), []))
+        level_regions[level_name].append(region)
+
+    for region in regions:
+        level_name = region_levels.get(region.name)
+        if level_name is None:
+            continue
+        table = tables[level_name]
+        for level_region_template in level_regions[level_name]:
+            region.locations.extend(
+                location._replace(requirement=table_requirement(table, location.name).fold(world))
+                for location in level_region_template.locations
+            )
+
+    return template._replace(regions=regions, entrances=entrances)
 
-    world.multiworld.regions.extend(regions)
+
+def create_level_tables() -> dict[str, dict[str, LevelTable]]:
+    """Build the reachability table of every level for every difficulty and portal setting."""
+
+    tables = {}
+    for difficulty, portal in itertools.product(sorted(all_difficulties), (Portal.option_vanilla, Portal.option_open)):
+        levels = tables[get_table_key(difficulty, portal)] = {}
+        for level_name, level_data in level_table.items():
+            regions = []
+            entrances = []
+            for region_data in level_data.regions:
+                region_name = get_region_name(level_name, region_data.name)
+                region = RegionTemplate(region_name, [])
+                for location_data in region_data.locations:
+                    if difficulty not in location_data.difficulties:
+                        continue
+                    if portal == Portal.option_open and location_data.type == LocationType.SWITCH:
+                        continue
+                    requirement = location_data.access_rule or TRUE
+                    event = None
+                    if location_data.type == LocationType.SWITCH:
+                        event = get_escape_event_name(level_name)
+                    elif portal == Portal.option_vanilla:
+                        requirement = requirement & has(get_escape_event_name(level_name))
+                    region.locations.append(LocationTemplate(
+                        f"{level_name} - {location_data.name}", event, False, None,
+                        fold_difficulty(requirement, difficulty), None
+                    ))
+                regions.append(region)
+                for exit_data in region_data.exits:
+                    entrances.append(EntranceTemplate(
+                        f"{level_name} - {region_data.name or 'Main area'} to {exit_data.destination or 'Main area'}",
+                        region_name,
+                        get_region_name(level_name, exit_data.destination),
+                        fold_difficulty(exit_data.access_rule or TRUE, difficulty),
+                    ))
+            levels[level_name] = create_level_table(regions, entrances, get_level_entrance_name(level_name))
+    return tables
 
 
 def make_boss_access_rule(passage: Passage, jewels_needed: int):
-    jewel_list = [(name, jewels_needed) for name in get_jewel_pieces_by_passage(passage)]
-    return has_all(jewel_list)
+    return has_jewels(passage, jewels_needed)
 
 
-def place_keyzer(world: WL4World, level: str, keyzer: str):
-    try:
-        location = world.get_location(f"{level} - Keyzer")
-    except KeyError:
-        pass
-    else:
-        location.place_locked_item(WL4Item(keyzer, world.player))
+def create_entrance_templates(world: WL4World) -> tuple[list[EntranceTemplate], list[tuple[str, str]]]:
+    entrances: dict[str, EntranceTemplate] = {}
+    keyzers = []
 
+    def connect_entrance(name: str, source: str, target: str, rule: Requirement | None = None):
+        entrances[name] = EntranceTemplate(name, source, target, TRUE if rule is None else rule.fold(world))
+
+    def add_requirement(name: str, rule: Requirement):
+        entrance = entrances[name]
+        entrances[name] = entrance._replace(requirement=entrance.requirement & rule.fold(world))
 
-def connect_regions(world: WL4World):
     required_jewels = world.options.required_jewels.value
     required_jewels_entry = min(1, required_jewels)
 
     for passage, levels in passage_levels.items():
-        connect_entrance(world, f"{passage.long_name()} Entrance", "Pyramid", passage.long_name())
-        connect_entrance(world, f"{levels[0]} Entrance", passage.long_name(), get_level_entrance_name(levels[0]))
+        connect_entrance(f"{passage.long_name()} Entrance", "Pyramid", passage.long_name())
+        connect_entrance(f"{levels[0]} Entrance", passage.long_name(), get_level_entrance_name(levels[0]))
         for i, (source, destination) in enumerate(itertools.pairwise(levels), 1):
             keyzer_name = f"Keyzer ({passage.long_name()} {i})"
             if not world.options.keyzer_shuffle:
-                place_keyzer(world, source, keyzer_name)
+                keyzers.append((source, keyzer_name))
             connect_entrance(
-                world,
                 f"{destination} Entrance",
                 get_level_entrance_name(source),
                 get_level_entrance_name(destination),
@@ -196,11 +426,10 @@ def connect_regions(world: WL4World):
             )
         keyzer_name = f"Keyzer ({passage.long_name()} Boss)"
         if not world.options.keyzer_shuffle:
-            place_keyzer(world, levels[-1], keyzer_name)
+            keyzers.append((levels[-1], keyzer_name))
         if passage != Passage.ENTRY:
             boss_access = make_boss_access_rule(passage, required_jewels_entry if passage == Passage.GOLDEN else required_jewels)
             connect_entrance(
-                world,
                 f"{passage.long_name()} Boss Door",
                 get_level_entrance_name(levels[-1]),
                 f"{passage.long_name()} Boss",
@@ -210,19 +439,16 @@ def connect_regions(world: WL4World):
             )
 
     if world.options.open_doors.value != OpenDoors.option_open:
-        add_rule(world.get_entrance("Golden Pyramid Boss Door"), has("Keyzer (Golden Pyramid Boss)").apply_world(world))
-
-    add_rule(
-        world.get_entrance("Golden Pyramid Entrance"),
-        lambda state: state.has_all(
-            [
-                "Emerald Passage Clear",
-                "Ruby Passage Clear",
-                "Topaz Passage Clear",
-                "Sapphire Passage Clear",
-            ],
-            world.player,
-        ),
+        add_requirement("Golden Pyramid Boss Door", has("Keyzer (Golden Pyramid Boss)"))
+
+    add_requirement(
+        "Golden Pyramid Entrance",
+        has_all([
+            "Emerald Passage Clear",
+            "Ruby Passage Clear",
+            "Topaz Passage Clear",
+            "Sapphire Passage Clear",
+        ]),
     )
 
     for level_name, level_data in level_table.items():
@@ -232,7 +458,6 @@ def connect_regions(world: WL4World):
                 destination = get_region_name(level_name, exit_data.destination)
 
                 connect_entrance(
-                    world,
                     f"{level_name} - {region_data.name or 'Main area'} to {exit_data.destination or 'Main area'}",
                     source,
                     destination,
@@ -242,22 +467,64 @@ def connect_regions(world: WL4World):
     if (world.options.goal.needs_treasure_hunt()):
         for passage, boss_data in passage_boss_table.items():
             connect_entrance(
-                world,
                 f"{passage.long_name()} Quick Kill",
                 f"{passage.long_name()} Boss",
                 f"{boss_data.name} - Prizes",
                 boss_data.kill_rule & boss_data.quick_kill_rule if boss_data.quick_kill_rule else boss_data.kill_rule
             )
 
+    return list(entrances.values()), keyzers
+
+
+def create_regions(world: WL4World):
+    template = get_world_template(world)
+
+    for level_name in level_table:
+        world.levels[level_name] = WL4Level(world)
+
+    regions = []
+    for region_template in template.regions:
+        region = WL4Region(region_template.name, world)
+        for location_template in region_template.locations:
+            if location_template.event is not None:
+                location = create_event(region, location_template.name, location_template.event)
+            else:
+                location = WL4Location(world.player, location_template.name, region, location_template.force_event)
+                if location_template.level is not None:
+                    world.levels[location_template.level].locations.append(location)
+            if location_template.requirement is not TRUE:
+                world.rule_index.add(location_template.requirement, location)
+            if location_template.allowed_items is not None:
+                assert type(location) is WL4Location
+                location.set_allowed_items(location_template.allowed_items)
+            region.locations.append(location)
+        regions.append(region)
+
+    world.multiworld.regions.extend(regions)
+
+
+def place_keyzer(world: WL4World, level: str, keyzer: str):
+    try:
+        location = world.get_location(f"{level} - Keyzer")
+    except KeyError:
+        pass
+    else:
+        location.place_locked_item(WL4Item(keyzer, world.player))
+
+
+def connect_regions(world: WL4World):
+    template = get_world_template(world)
 
-def connect_entrance(world: WL4World, name: str, source: str, target: str, rule: Requirement | None = None):
-    source_region = world.get_region(source)
-    target_region = world.get_region(target)
+    for level, keyzer in template.keyzers:
+        place_keyzer(world, level, keyzer)
 
-    connection = Entrance(world.player, name, source_region)
+    for entrance_template in template.entrances:
+        source_region = world.get_region(entrance_template.source)
+        target_region = world.get_region(entrance_template.target)
 
-    if rule:
-        connection.access_rule = rule.apply_world(world)
+        connection = Entrance(world.player, entrance_template.name, source_region)
+        if entrance_template.requirement is not TRUE:
+            world.rule_index.add(entrance_template.requirement, connection)
 
-    source_region.exits.append(connection)
-    connection.connect(target_region)
+        source_region.exits.append(connection)
+        connection.connect(target_region)
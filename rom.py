@@ -1,6 +1,10 @@
 from __future__ import annotations
 
+import hashlib
 import itertools
+import logging
+import mmap
+import os
 import random
 import struct
 from pathlib import Path
@@ -56,11 +60,72 @@ def patch_instructions(patch: WL4ProcedurePatch, address: int, *instructions: in
 
 
 class WL4PatchExtensions(APPatchExtension):
+    """
+    The first of these steps to run after the base patch, normally
+    apply_tokens, copies the ROM into a bytearray, and the rest edit that same
+    buffer in place and pass it on. The procedure writes the buffer out at the
+    end, so the ROM isn't copied again after that. When the base patch has
+    been applied before, that bytearray is copied straight from the mapped
+    cache file instead.
+    """
+
     game = "Wario Land 4"
 
     @staticmethod
-    def update_header(caller: APProcedurePatch, rom: bytes) -> bytes:
-        rombuffer = bytearray(rom)
+    def apply_bsdiff4(caller: APProcedurePatch, rom: bytes | MappedRom, patch: str) -> bytes | bytearray:
+        """
+        Apply the base patch like the core step of the same name, but keep the
+        result in the cache directory. It only depends on the base ROM and the
+        patch, so every seed patched with the same ones reuses it.
+        """
+
+        patch_data = caller.get_file(patch)
+        rom_hash = rom.md5 if isinstance(rom, MappedRom) else hashlib.md5(rom).hexdigest()
+        cache_path = get_patched_base_rom_path(rom_hash, hashlib.sha256(patch_data).hexdigest())
+        cached = read_patched_base_rom(cache_path)
+        if cached is not None:
+            with cached:
+                return bytearray(cached)
+
+        import bsdiff4
+        # bsdiff4 only takes bytes, not a mapped ROM
+        patched = bsdiff4.patch(bytes(rom), patch_data)
+        write_patched_base_rom(cache_path, rom_hash, patched)
+        return patched
+
+    @staticmethod
+    def apply_tokens(caller: APProcedurePatch, rom: bytes | bytearray, token_file: str) -> bytearray:
+        """Apply the tokens like the core step of the same name, but to the shared buffer instead of a copy."""
+
+        rombuffer = LocalRom(rom).buffer
+        token_data = caller.get_file(token_file)
+        (token_count,) = struct.unpack_from("<I", token_data)
+        position = 4
+        for _ in range(token_count):
+            token_type = token_data[position]
+            offset, size = struct.unpack_from("<II", token_data, position + 1)
+            data = token_data[position + 9:position + 9 + size]
+            position += 9 + size
+            match token_type:
+                case APTokenTypes.AND_8:
+                    rombuffer[offset] &= data[0]
+                case APTokenTypes.OR_8:
+                    rombuffer[offset] |= data[0]
+                case APTokenTypes.XOR_8:
+                    rombuffer[offset] ^= data[0]
+                case APTokenTypes.COPY:
+                    length, source = struct.unpack("<II", data)
+                    rombuffer[offset:offset + length] = rombuffer[source:source + length]
+                case APTokenTypes.RLE:
+                    length, value = struct.unpack("<II", data)
+                    rombuffer[offset:offset + length] = bytes([value]) * length
+                case _:
+                    rombuffer[offset:offset + size] = data
+        return rombuffer
+
+    @staticmethod
+    def update_header(caller: APProcedurePatch, rom: bytes | bytearray) -> bytearray:
+        rombuffer = LocalRom(rom).buffer
 
         # Change game name
         game_name = rombuffer[0xA0:0xAC].decode("ascii")
@@ -79,17 +144,18 @@ class WL4PatchExtensions(APPatchExtension):
         checksum -= 0x19
         rombuffer[0xBD] = checksum & 0xFF
 
-        return bytes(rombuffer)
+        return rombuffer
 
     @staticmethod
-    def shuffle_music_and_wario_voice(caller: APProcedurePatch, rom: bytes, music: int, voices: int) -> bytes:
+    def shuffle_music_and_wario_voice(caller: APProcedurePatch, rom: bytes | bytearray,
+                                      music: int, voices: int) -> bytearray:
         local_rom = LocalRom(rom)
         shuffle_music(local_rom, music)
         shuffle_wario_voice_sets(local_rom, voices)
-        return bytes(local_rom)
+        return local_rom.buffer
 
     @staticmethod
-    def copy_medal_gfx(caller: APProcedurePatch, rom: bytes, address: int) -> bytes:
+    def copy_medal_gfx(caller: APProcedurePatch, rom: bytes | bytearray, address: int) -> bytearray:
         local_rom = LocalRom(rom)
         top_tiles = local_rom.read_bytes(0x6E561C + 32 * 645, 32 * 2)
         bottom_tiles = local_rom.read_bytes(0x6E561C + 32 * 677, 32 * 2)
@@ -103,7 +169,7 @@ class WL4PatchExtensions(APPatchExtension):
                 lower += 10
             tiles.append(upper | lower)
         local_rom.write_bytes(address, tiles)
-        return bytes(local_rom)
+        return local_rom.buffer
 
 
 class WL4ProcedurePatch(APProcedurePatch, APTokenMixin):
@@ -113,9 +179,11 @@ class WL4ProcedurePatch(APProcedurePatch, APTokenMixin):
     result_file_ending = ".gba"
 
     procedure: list[tuple[str, list[Any]]]
+    token_count: int
 
     def __init__(self, *args, **kwargs):
         super(WL4ProcedurePatch, self).__init__(*args, **kwargs)
+        self.token_count = 0
         self.procedure = [
             ("apply_bsdiff4", ["basepatch.bsdiff"]),
             ("apply_tokens", ["token_data.bin"]),
@@ -123,10 +191,13 @@ class WL4ProcedurePatch(APProcedurePatch, APTokenMixin):
             ("copy_medal_gfx", [get_rom_address("MinigameCoinTiles")]),
         ]
 
+    def write_token(self, token_type: APTokenTypes, offset: int, data: bytes | tuple[int, int] | int):
+        self.token_count += 1
+        super(WL4ProcedurePatch, self).write_token(token_type, offset, data)
+
     @classmethod
-    def get_source_data(cls) -> bytes:
-        with open(get_base_rom_path(), "rb") as stream:
-            return stream.read()
+    def get_source_data(cls) -> MappedRom:
+        return map_rom(get_base_rom_path())
 
 
 def get_base_rom_path(file_name: str = "") -> Path:
@@ -141,6 +212,64 @@ def get_base_rom_path(file_name: str = "") -> Path:
         return Path(Utils.user_path(file_name))
 
 
+class MappedRom(mmap.mmap):
+    """A read-only mapping of a ROM file, which knows the file's MD5."""
+    md5: str
+
+
+# (Resolved path, size, modification time) -> MD5 of every ROM file mapped so far
+_rom_md5s: dict[tuple[str, int, int], str] = {}
+
+
+def map_rom(path: Path) -> MappedRom:
+    """
+    Map a ROM file instead of reading it. Its MD5 is only computed the first time
+    the file is mapped, and again after its size or modification time changes.
+    """
+
+    with open(path, "rb") as file:
+        stat = os.fstat(file.fileno())
+        rom = MappedRom(file.fileno(), 0, access=mmap.ACCESS_READ)
+    key = (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+    if key not in _rom_md5s:
+        _rom_md5s[key] = hashlib.md5(rom).hexdigest()
+    rom.md5 = _rom_md5s[key]
+    return rom
+
+
+def get_patched_base_rom_path(rom_hash: str, patch_hash: str) -> Path:
+    return Path(Utils.cache_path("wl4", f"{rom_hash}-{patch_hash}.gba"))
+
+
+def read_patched_base_rom(path: Path) -> mmap.mmap | None:
+    try:
+        with open(path, "rb") as file:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):  # Mapping an empty file raises ValueError
+        return None
+
+
+def write_patched_base_rom(path: Path, rom_hash: str, data: bytes):
+    """Cache a patched base ROM, and remove the ones patched from the same ROM with other base patches."""
+
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+    except OSError as error:
+        logging.warning(f"Couldn't cache the patched Wario Land 4 ROM: {error}")
+        return
+
+    for old_path in path.parent.glob(f"{rom_hash}-*.gba"):
+        if old_path != path:
+            try:
+                old_path.unlink()
+            except OSError:
+                pass  # Another process may have it open
+
+
 def write_tokens(world: WL4World, patch: WL4ProcedurePatch):
     fill_items(world, patch)
 
@@ -237,8 +366,8 @@ class MultiworldData(NamedTuple):
 
 def fill_items(world: WL4World, patch: WL4ProcedurePatch):
     # Place item IDs and collect multiworld entries
-    multiworld_items = {}
-    location_count = 0
+    item_ids: dict[int, bytes] = {}
+    multiworld_items: dict[int, MultiworldData | None] = {}
     for location in world.get_locations():
         assert isinstance(location, WL4LocationBase)
         if type(location) is not WL4Location:
@@ -269,30 +398,41 @@ def fill_items(world: WL4World, patch: WL4ProcedurePatch):
             player_name = world.multiworld.player_name[player_id]
 
         location_offset = location.level_offset() + location.entry_offset()
-        patch.write_token(
-            APTokenTypes.WRITE,
-            get_rom_address("ItemLocationTable", location_offset),
-            item_id.to_bytes(1, "little")
-        )
-
-        multiworld_data_location = get_rom_address("MultiworldDataTable", 4 * location_offset)
+        item_ids[location_offset] = item_id.to_bytes(1, "little")
         if player_name is not None:
-            multiworld_items[multiworld_data_location] = MultiworldData(player_name, item_name)
+            multiworld_items[location_offset] = MultiworldData(player_name, item_name)
         else:
-            multiworld_items[multiworld_data_location] = None
-
-        location_count += 1
+            multiworld_items[location_offset] = None
 
+    write_table(patch, get_rom_address("ItemLocationTable"), 1, item_ids)
     patch.write_token(
         APTokenTypes.WRITE,
         get_rom_address("sLocationCount"),
-        location_count.to_bytes(2, "little"),
+        len(item_ids).to_bytes(2, "little"),
     )
 
     create_starting_inventory(world, patch)
 
-    strings = create_strings(patch, multiworld_items)
-    write_multiworld_table(patch, multiworld_items, strings)
+    write_multiworld_table(patch, multiworld_items)
+
+
+def write_table(patch: WL4ProcedurePatch, address: int, entry_size: int, entries: dict[int, bytes]):
+    """
+    Write the entries of a table, keyed by index, with one token for each run of
+    consecutive indices. Entries that aren't given keep their contents.
+    """
+
+    run_start = 0
+    run = bytearray()
+    for index in sorted(entries):
+        if run and index != run_start + len(run) // entry_size:
+            patch.write_token(APTokenTypes.WRITE, address + run_start * entry_size, bytes(run))
+            run.clear()
+        if not run:
+            run_start = index
+        run += entries[index]
+    if run:
+        patch.write_token(APTokenTypes.WRITE, address + run_start * entry_size, bytes(run))
 
 
 class StartInventory:
@@ -385,56 +525,46 @@ def create_starting_inventory(world: WL4World, patch: WL4ProcedurePatch):
     start_inventory.write(patch)
 
 
-def create_strings(patch: WL4ProcedurePatch,
-                   multiworld_items: dict[int, MultiworldData | None]
-                   ) -> dict[str | None, int]:
+def create_strings(multiworld_items: dict[int, MultiworldData | None], address: int
+                   ) -> tuple[dict[str | None, int], bytes]:
+    """Encode the receivers' and items' names to go at `address`, and map each name to its address in game."""
+
     receivers: set[str] = set()
     items: set[str] = set()
-    address = get_rom_address("MultiworldStringDump")
     for item in multiworld_items.values():
         if item is None:
             continue
         receivers.add(item.receiver)
         items.add(item.name)
-        address += 8
 
-    strings: dict[str | None, int] = {None: 0}  # Map a string to its address in game
+    strings: dict[str | None, int] = {None: 0}
+    data = bytearray()
     for string in itertools.chain(receivers, items):
         if string not in strings:
-            strings[string] = address | 0x8000000
-            encoded = encode_str(string) + b"\xFE"
-            patch.write_token(
-                APTokenTypes.WRITE,
-                address,
-                encoded
-            )
-            address += len(encoded)
-    return strings
-
-
-def write_multiworld_table(patch: WL4ProcedurePatch,
-                           multiworld_items: dict[int, MultiworldData | None],
-                           strings: dict[str | None, int]):
-    entry_address = get_rom_address("MultiworldStringDump")
-    for location_address, item in multiworld_items.items():
+            strings[string] = (address + len(data)) | 0x8000000
+            data += encode_str(string) + b"\xFE"
+    return strings, bytes(data)
+
+
+def write_multiworld_table(patch: WL4ProcedurePatch, multiworld_items: dict[int, MultiworldData | None]):
+    # The string dump starts with an entry for each foreign item, followed by the strings the entries point to
+    dump_address = get_rom_address("MultiworldStringDump")
+    entry_count = sum(item is not None for item in multiworld_items.values())
+    strings, string_data = create_strings(multiworld_items, dump_address + 8 * entry_count)
+
+    table: dict[int, bytes] = {}
+    dump = bytearray()
+    for location_offset, item in multiworld_items.items():
         if item is None:
-            patch.write_token(
-                APTokenTypes.WRITE,
-                location_address,
-                (0).to_bytes(4, "little")
-            )
+            table[location_offset] = (0).to_bytes(4, "little")
         else:
-            patch.write_token(
-                APTokenTypes.WRITE,
-                location_address,
-                (entry_address | 0x8000000).to_bytes(4, "little")
-            )
-            patch.write_token(
-                APTokenTypes.WRITE,
-                entry_address,
-                struct.pack("<II", strings[item.receiver], strings[item.name])
-            )
-            entry_address += 8
+            table[location_offset] = ((dump_address + len(dump)) | 0x8000000).to_bytes(4, "little")
+            dump += struct.pack("<II", strings[item.receiver], strings[item.name])
+    dump += string_data
+
+    write_table(patch, get_rom_address("MultiworldDataTable"), 4, table)
+    if dump:
+        patch.write_token(APTokenTypes.WRITE, dump_address, bytes(dump))
 
 
 def set_goal(patch: WL4ProcedurePatch, _goal: Goal):
@@ -500,8 +630,11 @@ def set_difficulty_level(patch: WL4ProcedurePatch, difficulty: Difficulty):
 
 
 class LocalRom():
-    def __init__(self, rom: bytes):
-        self.buffer = bytearray(rom)
+    buffer: bytearray
+
+    def __init__(self, rom: bytes | bytearray):
+        # Edit a bytearray in place instead of copying it
+        self.buffer = rom if isinstance(rom, bytearray) else bytearray(rom)
 
     def read_bit(self, address: int, bit_number: int) -> bool:
         bitflag = (1 << bit_number)
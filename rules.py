@@ -1,22 +1,39 @@
 from __future__ import annotations
 
+from collections import defaultdict
+from dataclasses import dataclass
 import functools
-from typing import Callable, Iterable, NamedTuple, TYPE_CHECKING
+import operator
+import time
+from typing import Callable, Iterable, TYPE_CHECKING
 
-from BaseClasses import CollectionState
+from BaseClasses import CollectionState, Entrance, Location, MultiWorld
+from worlds.AutoWorld import LogicMixin
+from worlds.generic.Rules import CollectionRule, add_rule
 
-from .items import golden_treasure_table
-from .options import Logic
+from .data import Passage
+from .items import (
+    GoldenTreasureItemData,
+    JewelPieceItemData,
+    get_jewel_pieces_by_passage,
+    golden_treasure_table,
+    item_table,
+)
+from .options import Difficulty as DifficultyOption, Logic
 
 if TYPE_CHECKING:
     from . import WL4World
+    from .profiling import RuleProfiler, RuleStats
 
 
-__all__ = ["Requirement", "has", "has_all", "has_any", "has_treasures", "option", "difficulty", "not_difficulty", "advanced_logic"]
+__all__ = ["Requirement", "has", "has_all", "has_any", "has_treasures", "has_jewels", "option", "difficulty", "not_difficulty",
+           "advanced_logic"]
 
 
 RequiredItem = str | tuple[str, int]
 
+StateRule = Callable[[CollectionState], bool]
+
 
 helpers: dict[str, tuple[str, int]] = {
     "Ground Pound":       ("Progressive Ground Pound", 1),
@@ -32,67 +49,547 @@ def resolve_helper(item_name: RequiredItem):
     return item_name
 
 
-class Requirement(NamedTuple):
-    inner: Callable[[WL4World, CollectionState], bool]
+all_difficulties = frozenset((DifficultyOption.option_normal, DifficultyOption.option_hard, DifficultyOption.option_s_hard))
 
-    def __or__(self, rhs: Requirement):
-        return Requirement(lambda w, s: self.inner(w, s) or rhs.inner(w, s))
 
-    def __and__(self, rhs: Requirement):
-        return Requirement(lambda w, s: self.inner(w, s) and rhs.inner(w, s))
+class Requirement:
+    """
+    A node in a logic rule. Rules are plain data: they can be inspected, combined
+    with `|` and `&`, and compiled to an access rule for a world with
+    `apply_world`. Nodes are interned, so equal rules are usually the same object.
+    """
 
-    def apply_world(self, world: WL4World):
-        return functools.partial(self.inner, world)
+    __slots__ = ()
 
+    def __or__(self, rhs: Requirement) -> Requirement:
+        return any_of(self, rhs)
 
-def has(item_name: RequiredItem) -> Requirement:
-    item, count = resolve_helper(item_name)
-    return Requirement(lambda w, s: s.has(item, w.player, count))
+    def __and__(self, rhs: Requirement) -> Requirement:
+        return all_of(self, rhs)
+
+    def fold(self, world: WL4World) -> Requirement:
+        """Resolve everything that depends only on the world's options, leaving item checks."""
+        return self
+
+    def compile(self, world: WL4World) -> StateRule:
+        """Turn a folded requirement into a function of the collection state."""
+        raise TypeError(f"{type(self).__name__} can't be compiled, fold the requirement with `fold` first")
+
+    def items(self) -> frozenset[str]:
+        """The names of every item this rule checks."""
+        return frozenset()
+
+    def apply_world(self, world: WL4World) -> CollectionRule | None:
+        """Compile this requirement for a world. Options are resolved now, so the
+        returned rule only checks items. Returns None if the rule is always met."""
+
+        return self.fold(world).bind(world)
+
+    def bind(self, world: WL4World, stats: RuleStats | None = None) -> CollectionRule | None:
+        """Compile an already folded requirement into an access rule. The result is
+        cached in the collection state until one of the rule's items changes.
+        With `stats`, the rule counts cache hits and times the misses there."""
+
+        if self is TRUE:
+            return None
+        if self is FALSE:
+            return _never
+        rule = self.compile(world)
+        player = world.player
+        key = id(self)  # Folded rules are interned and live as long as the process
+        world.rule_index.watch(self)
+
+        if stats is not None:
+            clock = time.perf_counter
+
+            def profiled_access_rule(state: CollectionState):
+                results = state.wl4_rule_results[player]
+                result = results.get(key)
+                if result is None:
+                    start = clock()
+                    result = results[key] = rule(state)
+                    stats.time += clock() - start
+                    stats.misses += 1
+                else:
+                    stats.hits += 1
+                stats.true += result
+                return result
+
+            return profiled_access_rule
+
+        def access_rule(state: CollectionState):
+            results = state.wl4_rule_results[player]
+            result = results.get(key)
+            if result is None:
+                result = results[key] = rule(state)
+            return result
+
+        return access_rule
+
+
+@dataclass(frozen=True, slots=True)
+class Has(Requirement):
+    item: str
+    count: int = 1
+
+    def __str__(self):
+        return self.item if self.count == 1 else f"{self.item} x{self.count}"
+
+    def items(self) -> frozenset[str]:
+        return frozenset((self.item,))
+
+    def compile(self, world: WL4World) -> StateRule:
+        return _compile_items(world.player, [self], _has_all_bits, _has_all_counts)
+
+
+@dataclass(frozen=True, slots=True)
+class All(Requirement):
+    children: tuple[Requirement, ...]
+
+    def __str__(self):
+        return f"({' & '.join(map(str, self.children))})" if self.children else "True"
+
+    def fold(self, world: WL4World) -> Requirement:
+        return all_of(*(child.fold(world) for child in self.children))
+
+    def items(self) -> frozenset[str]:
+        return frozenset().union(*(child.items() for child in self.children))
+
+    def compile(self, world: WL4World) -> StateRule:
+        return _compile_children(world, self.children, _has_all_bits, _has_all_counts, _all)
+
+
+@dataclass(frozen=True, slots=True)
+class Any(Requirement):
+    children: tuple[Requirement, ...]
+
+    def __str__(self):
+        return f"({' | '.join(map(str, self.children))})" if self.children else "False"
+
+    def fold(self, world: WL4World) -> Requirement:
+        return any_of(*(child.fold(world) for child in self.children))
+
+    def items(self) -> frozenset[str]:
+        return frozenset().union(*(child.items() for child in self.children))
+
+    def compile(self, world: WL4World) -> StateRule:
+        return _compile_children(world, self.children, _has_any_bits, _has_any_counts, _any)
+
+
+@dataclass(frozen=True, slots=True)
+class Option(Requirement):
+    name: str
+    value: int
+
+    def fold(self, world: WL4World) -> Requirement:
+        return TRUE if getattr(world.options, self.name).value == self.value else FALSE
+
+
+@dataclass(frozen=True, slots=True)
+class Difficulty(Requirement):
+    difficulties: frozenset[int]
+
+    def fold(self, world: WL4World) -> Requirement:
+        return TRUE if world.options.difficulty.value in self.difficulties else FALSE
+
+
+@dataclass(frozen=True, slots=True)
+class Trick(Requirement):
+    """
+    A strategy that's only in logic when enabled. `name` is its entry in `trick_table`, if it has one; unnamed tricks
+    follow the Logic option.
+    """
+
+    name: str | None = None
+
+    def fold(self, world: WL4World) -> Requirement:
+        if self.name is None:
+            enabled = world.options.logic.value == Logic.option_advanced
+        else:
+            enabled = self.name in world.enabled_tricks
+        if enabled:
+            return TRUE
+        if world.is_universal_tracker():
+            return has(world.glitches_item_name)
+        return FALSE
+
+
+@dataclass(frozen=True, slots=True)
+class Treasures(Requirement):
+    """Enough golden treasures to satisfy the Golden Treasure Count option."""
+
+    def __str__(self):
+        return "Golden Treasures"
+
+    def items(self) -> frozenset[str]:
+        return frozenset(golden_treasure_table)
+
+    def compile(self, world: WL4World) -> StateRule:
+        return functools.partial(_has_treasures, world.player, world.options.golden_treasure_count.value)
+
+
+@dataclass(frozen=True, slots=True)
+class Jewels(Requirement):
+    """At least `count` of every piece of a passage's jewel."""
+
+    passage: Passage
+    count: int
+
+    def __str__(self):
+        return f"{self.passage.long_name()} Jewels x{self.count}"
+
+    def items(self) -> frozenset[str]:
+        return frozenset(get_jewel_pieces_by_passage(self.passage))
+
+    def compile(self, world: WL4World) -> StateRule:
+        return functools.partial(_has_jewels, world.player, self.passage, self.count)
+
+
+_nodes: dict[Requirement, Requirement] = {}
+
+
+def _intern(node: Requirement) -> Requirement:
+    return _nodes.setdefault(node, node)
+
+
+TRUE = _intern(All(()))
+FALSE = _intern(Any(()))
+
+
+def _implies(lhs: Requirement, rhs: Requirement) -> bool:
+    """Conservatively check whether `lhs` being met means `rhs` is too."""
+
+    if lhs == rhs:
+        return True
+    if type(rhs) is All:
+        return all(_implies(lhs, child) for child in rhs.children)
+    if type(lhs) is Any:
+        return all(_implies(child, rhs) for child in lhs.children)
+    if type(rhs) is Any and any(_implies(lhs, child) for child in rhs.children):
+        return True
+    if type(lhs) is All and any(_implies(child, rhs) for child in lhs.children):
+        return True
+    if type(lhs) is Has and type(rhs) is Has:
+        return lhs.item == rhs.item and lhs.count >= rhs.count
+    if type(lhs) is Jewels and type(rhs) is Jewels:
+        return lhs.passage == rhs.passage and lhs.count >= rhs.count
+    return False
 
-def _has_all(items: list[tuple[str, int]], state: CollectionState, player: int, ):
+
+def _simplify(node_type: type[All] | type[Any], children: Iterable[Requirement]) -> Requirement:
+    conjunction = node_type is All
+
+    flattened: list[Requirement] = []
+    difficulties: frozenset[int] | None = None
+    for child in children:
+        if type(child) is node_type:
+            nested = child.children
+        else:
+            nested = (child,)
+        for grandchild in nested:
+            if grandchild is (FALSE if conjunction else TRUE):
+                return grandchild
+            if type(grandchild) is Difficulty:
+                # Merge every difficulty check into the position of the first one
+                if difficulties is None:
+                    flattened.append(grandchild)
+                    difficulties = grandchild.difficulties
+                elif conjunction:
+                    difficulties &= grandchild.difficulties
+                else:
+                    difficulties |= grandchild.difficulties
+            elif grandchild not in flattened:
+                flattened.append(grandchild)
+
+    if difficulties is not None:
+        if difficulties == (frozenset() if conjunction else all_difficulties):
+            return FALSE if conjunction else TRUE
+        if difficulties == (all_difficulties if conjunction else frozenset()):
+            flattened = [child for child in flattened if type(child) is not Difficulty]
+        else:
+            flattened = [_intern(Difficulty(difficulties)) if type(child) is Difficulty else child
+                         for child in flattened]
+
+    # Absorption: in `a | (a & b)` or `a & (a | b)`, only `a` matters
+    redundant = set()
+    for i, child in enumerate(flattened):
+        for j, other in enumerate(flattened):
+            if i == j or j in redundant:
+                continue
+            weaker, stronger = (other, child) if conjunction else (child, other)
+            if _implies(weaker, stronger) and (j < i or not _implies(stronger, weaker)):
+                redundant.add(i)
+                break
+    flattened = [child for i, child in enumerate(flattened) if i not in redundant]
+
+    if len(flattened) == 1:
+        return flattened[0]
+    return _intern(node_type(tuple(flattened)))
+
+
+def all_of(*requirements: Requirement) -> Requirement:
+    return _simplify(All, requirements)
+
+
+def any_of(*requirements: Requirement) -> Requirement:
+    return _simplify(Any, requirements)
+
+
+class InventoryLayout:
+    """
+    Packs the items a player's rules can check into a single integer. Each item
+    gets one bit per copy a rule can ask for, filled from the lowest bit up, so
+    having at least `n` copies of an item is one bit, and checking several items
+    at once is a mask comparison.
+    """
+
+    fields: dict[str, tuple[int, int]]  # Item name -> (shift, width)
+    size: int
+
+    def __init__(self):
+        self.fields = {}
+        self.size = 0
+
+    def add(self, item_name: str, width: int = 1):
+        if item_name not in self.fields:
+            self.fields[item_name] = (self.size, width)
+            self.size += width
+
+    def bit(self, item_name: str, count: int) -> int | None:
+        field = self.fields.get(item_name)
+        if field is None or count > field[1]:
+            return None
+        shift, _ = field
+        return 1 << (shift + count - 1)
+
+    def mask(self, item_names: Iterable[str]) -> int:
+        return functools.reduce(operator.or_, (self.bit(name, 1) or 0 for name in item_names), 0)
+
+    def update(self, state: CollectionState, player: int, item_name: str):
+        field = self.fields.get(item_name)
+        if field is None:
+            return
+        shift, width = field
+        count = min(state.prog_items[player][item_name], width)
+        inventory = state.wl4_inventory[player] & ~(((1 << width) - 1) << shift)
+        state.wl4_inventory[player] = inventory | (((1 << count) - 1) << shift)
+
+
+def _create_inventory_layout():
+    layout = InventoryLayout()
+    for name, data in item_table.items():
+        if type(data) is JewelPieceItemData:
+            layout.add(name, 4)  # Required Jewels goes up to 4
+        elif name.startswith("Progressive"):
+            layout.add(name, 2)
+        else:
+            layout.add(name)
+    return layout
+
+
+# Events are added by the regions module
+inventory_layout = _create_inventory_layout()
+
+
+def _compile_items(player: int, items: Iterable[Has], bits_rule, counts_rule) -> StateRule:
+    mask = 0
+    counts = []
+    for item in items:
+        bit = inventory_layout.bit(item.item, item.count)
+        if bit is None:
+            counts.append((item.item, item.count))
+        else:
+            mask |= bit
+    if not counts:
+        return functools.partial(bits_rule, player, mask)
+    if not mask:
+        return functools.partial(counts_rule, player, tuple(counts))
+    # Only items the layout doesn't know about need to be counted, which shouldn't normally happen
+    return functools.partial(
+        _all if bits_rule is _has_all_bits else _any,
+        (functools.partial(bits_rule, player, mask), functools.partial(counts_rule, player, tuple(counts)))
+    )
+
+
+def _compile_children(world: WL4World, children: Iterable[Requirement], bits_rule, counts_rule, combine) -> StateRule:
+    items = []
+    others = []
+    for child in children:
+        if type(child) is Has:
+            items.append(child)
+        else:
+            others.append(child.compile(world))
+    if items:
+        others.insert(0, _compile_items(world.player, items, bits_rule, counts_rule))
+    if len(others) == 1:
+        return others[0]
+    return functools.partial(combine, tuple(others))
+
+
+def _has_all_bits(player: int, mask: int, state: CollectionState):
+    return state.wl4_inventory[player] & mask == mask
+
+def _has_any_bits(player: int, mask: int, state: CollectionState):
+    return state.wl4_inventory[player] & mask != 0
+
+def _has_all_counts(player: int, items: tuple[tuple[str, int], ...], state: CollectionState):
+    counts = state.prog_items[player]
     for item, count in items:
-        if not state.has(item, player, count):
+        if counts[item] < count:
             return False
     return True
 
-def has_all(items: Iterable[RequiredItem]) -> Requirement:
-    resolved_items = [resolve_helper(item) for item in items]
-    return Requirement(lambda w, s: _has_all(resolved_items, s, w.player))
-
-def _has_any(items: list[tuple[str, int]], state: CollectionState, player: int):
+def _has_any_counts(player: int, items: tuple[tuple[str, int], ...], state: CollectionState):
+    counts = state.prog_items[player]
     for item, count in items:
-        if state.has(item, player, count):
+        if counts[item] >= count:
             return True
     return False
 
+def _all(rules: tuple[StateRule, ...], state: CollectionState):
+    for rule in rules:
+        if not rule(state):
+            return False
+    return True
+
+def _any(rules: tuple[StateRule, ...], state: CollectionState):
+    for rule in rules:
+        if rule(state):
+            return True
+    return False
+
+def _never(_: CollectionState):
+    return False
+
+
+class RuleIndex:
+    """
+    Collects the requirements of every location and entrance, then binds each
+    spot's combined requirement once. Spots with the same requirement share one
+    cached result per state, and each item maps to the rules, locations, and
+    entrances that check it, so that collecting or removing an item only throws
+    away the cached results of rules that could have changed.
+    """
+
+    player: int
+    rules: dict[str, set[int]]
+    spots: dict[str, list[Location | Entrance]]
+    requirements: dict[Location | Entrance, Requirement]  # The folded requirement of each spot
+
+    def __init__(self, player: int):
+        self.player = player
+        self.rules = defaultdict(set)
+        self.spots = defaultdict(list)
+        self.requirements = {}
+
+    def add(self, rule: Requirement, spot: Location | Entrance):
+        """Require a folded rule at a spot, in addition to anything it already requires."""
+        self.requirements[spot] = all_of(self.requirements.get(spot, TRUE), rule)
+
+    def bind(self, world: WL4World, profiler: RuleProfiler | None = None):
+        """Set the access rule of every spot from its combined requirement, profiling them if asked to."""
+        bound: dict[Requirement, CollectionRule | None] = {}
+        for spot, requirement in self.requirements.items():
+            for item in requirement.items():
+                self.spots[item].append(spot)
+            if profiler is not None:
+                rule = requirement.bind(world, profiler.add(spot, requirement))
+            else:
+                if requirement not in bound:
+                    bound[requirement] = requirement.bind(world)
+                rule = bound[requirement]
+            if rule is not None:
+                add_rule(spot, rule)
+
+    def watch(self, requirement: Requirement):
+        """Throw away a bound requirement's cached results whenever one of its items changes."""
+        for item in requirement.items():
+            self.rules[item].add(id(requirement))
+
+    def invalidate(self, state: CollectionState, item_name: str):
+        dependents = self.rules.get(item_name)
+        if dependents:
+            results = state.wl4_rule_results[self.player]
+            for key in dependents:
+                results.pop(key, None)
+
+
+class WL4LogicMixin(LogicMixin):
+    # Player -> items packed according to `inventory_layout`
+    wl4_inventory: dict[int, int]
+    # Player -> number of distinct golden treasures
+    wl4_treasures: dict[int, int]
+    # Player -> passage -> number of complete jewels
+    wl4_jewels: dict[int, list[int]]
+    # Player -> ID of a folded rule -> whether it's met in this state
+    wl4_rule_results: dict[int, dict[int, bool]]
+
+    def init_mixin(self, multiworld: MultiWorld):
+        players = [player for player in multiworld.get_all_ids() if multiworld.game[player] == "Wario Land 4"]
+        self.wl4_inventory = {player: 0 for player in players}
+        self.wl4_treasures = {player: 0 for player in players}
+        self.wl4_jewels = {player: [0] * len(Passage) for player in players}
+        self.wl4_rule_results = {player: {} for player in players}
+
+    def copy_mixin(self, new_state: CollectionState) -> CollectionState:
+        new_state.wl4_inventory = self.wl4_inventory.copy()
+        new_state.wl4_treasures = self.wl4_treasures.copy()
+        new_state.wl4_jewels = {player: jewels.copy() for player, jewels in self.wl4_jewels.items()}
+        new_state.wl4_rule_results = {player: results.copy() for player, results in self.wl4_rule_results.items()}
+        return new_state
+
+
+def has(item_name: RequiredItem) -> Requirement:
+    item, count = resolve_helper(item_name)
+    if count <= 0:
+        return TRUE
+    return _intern(Has(item, count))
+
+def has_all(items: Iterable[RequiredItem]) -> Requirement:
+    return all_of(*(has(item) for item in items))
+
 def has_any(items: Iterable[RequiredItem]) -> Requirement:
-    resolved_items = [resolve_helper(item) for item in items]
-    return Requirement(lambda w, s: _has_any(resolved_items, s, w.player))
+    return any_of(*(has(item) for item in items))
+
+_treasure_mask = inventory_layout.mask(golden_treasure_table)
+_jewel_pieces = {passage: tuple(get_jewel_pieces_by_passage(passage)) for passage in Passage}
+
+def update_counters(state: CollectionState, player: int, item_name: str):
+    """Recount the aggregates an item contributes to after it's collected or removed."""
+
+    data = item_table.get(item_name)
+    if type(data) is GoldenTreasureItemData:
+        state.wl4_treasures[player] = (state.wl4_inventory[player] & _treasure_mask).bit_count()
+    elif type(data) is JewelPieceItemData:
+        counts = state.prog_items[player]
+        state.wl4_jewels[player][data.passage] = min(counts[piece] for piece in _jewel_pieces[data.passage])
 
 def treasure_count(state: CollectionState, player: int):
-    count = 0
-    for treasure in golden_treasure_table:
-        if state.has(treasure, player):
-            count += 1
-    return count
+    return state.wl4_treasures[player]
+
+def _has_treasures(player: int, required: int, state: CollectionState):
+    return state.wl4_treasures[player] >= required
 
 def has_treasures() -> Requirement:
-    return Requirement(lambda w, s: treasure_count(s, w.player) >= w.options.golden_treasure_count.value)
+    return _intern(Treasures())
 
+def _has_jewels(player: int, passage: Passage, count: int, state: CollectionState):
+    return state.wl4_jewels[player][passage] >= count
 
-def option(option_name: str, choice: int):
-    return Requirement(lambda w, _: getattr(w.options, option_name).value == choice)
+def has_jewels(passage: Passage, count: int) -> Requirement:
+    if count <= 0:
+        return TRUE
+    return _intern(Jewels(passage, count))
 
-def difficulty(difficulty: int):
-    return option("difficulty", difficulty)
 
-def not_difficulty(_difficulty: int):
-    return Requirement(lambda w, s: not difficulty(_difficulty).inner(w, s))
+def option(option_name: str, choice: int) -> Requirement:
+    return _intern(Option(option_name, choice))
 
-def advanced_logic():
-    def can_sequence_break(world: WL4World, state):
-        if not world.is_universal_tracker():
-            return False
-        return has(world.glitches_item_name).inner(world, state)
+def difficulty(difficulty: int) -> Requirement:
+    return _intern(Difficulty(frozenset((difficulty,))))
+
+def not_difficulty(difficulty: int) -> Requirement:
+    return _intern(Difficulty(all_difficulties - {difficulty}))
 
-    return option("logic", Logic.option_advanced) | Requirement(can_sequence_break)
+def advanced_logic(trick: str | None = None) -> Requirement:
+    return _intern(Trick(trick))
@@ -0,0 +1,214 @@
+"""
+Generation benchmarks over a matrix of WL4 options.
+
+Every multiworld in a benchmark is made only of WL4 slots, each with the next
+combination of the options in `MATRIX`, so each slot count covers the whole
+matrix. The time of each generation stage and its peak memory are averaged per
+slot and compared to a stored baseline. Run it from the Archipelago directory:
+
+    python -m worlds.wl4.test.benchmark --save         # Record a baseline
+    python -m worlds.wl4.test.benchmark                # Compare against it
+
+Baselines depend on the machine, so they aren't shipped. Record one before
+making changes and compare on the same machine afterwards.
+"""
+
+from __future__ import annotations
+
+import itertools
+import json
+import math
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import Any, Callable, NamedTuple
+
+from BaseClasses import CollectionState, MultiWorld
+from Fill import distribute_items_restrictive
+from worlds.AutoWorld import call_all
+from test.general import gen_steps
+
+from .. import WL4World, options
+
+
+MATRIX: dict[str, tuple[int, ...]] = {
+    "difficulty": (options.Difficulty.option_normal, options.Difficulty.option_hard,
+                   options.Difficulty.option_s_hard),
+    "logic": (options.Logic.option_basic, options.Logic.option_advanced),
+    "diamond_shuffle": (False, True),
+    "portal": (options.Portal.option_vanilla, options.Portal.option_open),
+    "open_doors": (options.OpenDoors.option_off, options.OpenDoors.option_closed_diva, options.OpenDoors.option_open),
+    "keyzer_shuffle": (False, True),
+    "goal": (options.Goal.option_golden_diva, options.Goal.option_golden_treasure_hunt,
+             options.Goal.option_golden_diva_treasure_hunt),
+}
+
+STAGES = (*gen_steps, "fill", "generate_output")
+
+DEFAULT_SLOTS = (1, 10, 100)
+DEFAULT_BASELINE = Path(__file__).parent / "benchmark_baseline.json"
+
+
+def option_combinations() -> list[dict[str, int]]:
+    return [dict(zip(MATRIX, values)) for values in itertools.product(*MATRIX.values())]
+
+
+class StageResult(NamedTuple):
+    time: float  # Seconds per slot
+    memory: int  # Peak bytes allocated during the stage, per slot
+
+
+def create_multiworld(slot_options: list[dict[str, int]], seed: int) -> MultiWorld:
+    players = len(slot_options)
+    multiworld = MultiWorld(players)
+    multiworld.game = {player: WL4World.game for player in multiworld.player_ids}
+    multiworld.player_name = {player: f"Player{player}" for player in multiworld.player_ids}
+    multiworld.set_seed(seed)
+    multiworld.seed_name = str(seed)
+    args = Namespace()
+    for name, option in WL4World.options_dataclass.type_hints.items():
+        setattr(args, name, {
+            player: option.from_any(slot_options[player - 1].get(name, option.default))
+            for player in multiworld.player_ids
+        })
+    multiworld.set_options(args)
+    # Like Main and WorldTestBase, create_items needs it to push the starting keyzers
+    multiworld.state = CollectionState(multiworld)
+    return multiworld
+
+
+def run_stages(multiworld: MultiWorld, output_directory: str, measure: Callable[[str, Callable[[], Any]], None]):
+    for step in gen_steps:
+        measure(step, lambda: call_all(multiworld, step))
+    measure("fill", lambda: distribute_items_restrictive(multiworld))
+    measure("generate_output", lambda: call_all(multiworld, "generate_output", output_directory))
+
+
+def benchmark(slots: int, runs: int) -> dict[str, StageResult]:
+    """Generate `runs` multiworlds of `slots` slots each, once for time and once for memory."""
+
+    combinations = option_combinations()
+    random.Random(0).shuffle(combinations)
+    times = dict.fromkeys(STAGES, 0.0)
+    memory = dict.fromkeys(STAGES, 0)
+
+    def timed(stage: str, function: Callable[[], Any]):
+        start = time.perf_counter()
+        function()
+        times[stage] += time.perf_counter() - start
+
+    def traced(stage: str, function: Callable[[], Any]):
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+        memory[stage] = max(memory[stage], peak - start)
+
+    for run in range(runs):
+        slot_options = [combinations[(run * slots + slot) % len(combinations)] for slot in range(slots)]
+        with tempfile.TemporaryDirectory() as output_directory:
+            run_stages(create_multiworld(slot_options, run), output_directory, timed)
+
+            # Tracing slows everything down, so memory gets a separate generation of the same seed
+            tracemalloc.start()
+            try:
+                run_stages(create_multiworld(slot_options, run), output_directory, traced)
+            finally:
+                tracemalloc.stop()
+
+    return {
+        stage: StageResult(times[stage] / (runs * slots), memory[stage] // slots)
+        for stage in STAGES
+    }
+
+
+def compare(results: dict[str, dict[str, StageResult]], baseline: dict[str, dict[str, StageResult]],
+            threshold: float, min_time: float) -> list[str]:
+    """Describe every stage that got slower or used more memory than `threshold` allows."""
+
+    regressions = []
+    for slots, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(slots, {}).get(stage)
+            if base is None:
+                continue
+            if result.time > max(base.time, min_time) * (1 + threshold):
+                regressions.append(
+                    f"{slots} slots, {stage}: {result.time * 1000:.2f} ms/slot, was {base.time * 1000:.2f}"
+                )
+            if base.memory and result.memory > base.memory * (1 + threshold):
+                regressions.append(
+                    f"{slots} slots, {stage}: {result.memory / 1024:.0f} KiB/slot, was {base.memory / 1024:.0f}"
+                )
+    return regressions
+
+
+def format_results(results: dict[str, dict[str, StageResult]], baseline: dict[str, dict[str, StageResult]]) -> str:
+    lines = [f"{'Slots':>5}  {'Stage':<18} {'ms/slot':>10} {'Baseline':>10} {'KiB/slot':>10} {'Baseline':>10}"]
+    for slots, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(slots, {}).get(stage)
+            lines.append(
+                f"{slots:>5}  {stage:<18} {result.time * 1000:>10.2f} "
+                f"{'-' if base is None else f'{base.time * 1000:.2f}':>10} "
+                f"{result.memory / 1024:>10.0f} "
+                f"{'-' if base is None else f'{base.memory / 1024:.0f}':>10}"
+            )
+    return "\n".join(lines)
+
+
+def load_baseline(path: Path) -> dict[str, dict[str, StageResult]]:
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as file:
+        return {
+            slots: {stage: StageResult(*result) for stage, result in stages.items()}
+            for slots, stages in json.load(file).items()
+        }
+
+
+def save_baseline(path: Path, results: dict[str, dict[str, StageResult]]):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(
+            {slots: {stage: list(result) for stage, result in stages.items()} for slots, stages in results.items()},
+            file,
+            indent=1,
+        )
+        file.write("\n")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark WL4 generation over a matrix of options.")
+    parser.add_argument("--slots", type=int, nargs="+", default=DEFAULT_SLOTS,
+                        help="Numbers of WL4 slots per multiworld to benchmark")
+    parser.add_argument("--runs", type=int, default=None,
+                        help="Multiworlds to generate for each slot count (default: enough to cover the matrix)")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="Baseline file to compare against")
+    parser.add_argument("--save", action="store_true", help="Write the results to the baseline file")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Fraction a stage may grow by before it counts as a regression")
+    parser.add_argument("--min-time", type=float, default=0.0005,
+                        help="Seconds per slot below which time differences are ignored")
+    args = parser.parse_args()
+
+    results = {}
+    for slots in args.slots:
+        runs = args.runs or math.ceil(len(option_combinations()) / slots)
+        results[str(slots)] = benchmark(slots, runs)
+
+    baseline = load_baseline(args.baseline)
+    print(format_results(results, baseline))
+
+    if args.save:
+        save_baseline(args.baseline, results)
+        print(f"Saved baseline to {args.baseline}")
+    else:
+        regressions = compare(results, baseline, args.threshold, args.min_time)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,30 @@
+from ...options import Difficulty, Logic, Portal
+from .test_advanced import TestAdvancedHard, TestAdvancedNormal, TestAdvancedSHard
+from .test_open_portals import TestHardOpenPortal, TestNormalOpenPortal, TestSHardOpenPortal
+
+
+# Compact logic should give the same results as the full region graph
+
+
+class TestCompactAdvancedNormal(TestAdvancedNormal):
+    options = {"difficulty": Difficulty.option_normal, "logic": Logic.option_advanced, "compact_logic": True}
+
+
+class TestCompactAdvancedHard(TestAdvancedHard):
+    options = {"difficulty": Difficulty.option_hard, "logic": Logic.option_advanced, "compact_logic": True}
+
+
+class TestCompactAdvancedSHard(TestAdvancedSHard):
+    options = {"difficulty": Difficulty.option_s_hard, "logic": Logic.option_advanced, "compact_logic": True}
+
+
+class TestCompactNormalOpenPortal(TestNormalOpenPortal):
+    options = {"difficulty": Difficulty.option_normal, "portal": Portal.option_open, "compact_logic": True}
+
+
+class TestCompactHardOpenPortal(TestHardOpenPortal):
+    options = {"difficulty": Difficulty.option_hard, "portal": Portal.option_open, "compact_logic": True}
+
+
+class TestCompactSHardOpenPortal(TestSHardOpenPortal):
+    options = {"difficulty": Difficulty.option_s_hard, "portal": Portal.option_open, "compact_logic": True}
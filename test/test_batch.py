@@ -0,0 +1,61 @@
+from unittest import skipIf
+
+from BaseClasses import CollectionState
+
+from .. import options
+from .bases import WL4TestBase
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+else:
+    from ..batch import evaluate, make_inventories
+
+
+@skipIf(numpy is None, "NumPy is not installed")
+class TestBatchEvaluation(WL4TestBase):
+    options = {
+        "goal": options.Goal.option_golden_treasure_hunt,
+        "difficulty": options.Difficulty.option_hard,
+        "keyzer_shuffle": True,
+    }
+
+    def test_matches_collection_state(self):
+        """Every random inventory should reach the same spots as the equivalent CollectionState."""
+        world = self.multiworld.worlds[self.player]
+        pool = [item.name for item in self.multiworld.itempool if item.player == self.player and item.advancement]
+        random = self.multiworld.random
+        inventories = [[], pool]
+        inventories += [random.sample(pool, random.randrange(len(pool))) for _ in range(30)]
+
+        matrix, columns = make_inventories(inventories)
+        result = evaluate(world, matrix, columns)
+
+        for row, inventory in enumerate(inventories):
+            state = CollectionState(self.multiworld)
+            for item in inventory:
+                state.collect(self._create_items(item, self.player), True)
+            state.sweep_for_advancements()
+            for i, location in enumerate(result.locations):
+                with self.subTest(row=row, location=location.name):
+                    self.assertEqual(bool(result.location_reachable[row, i]), location.can_reach(state))
+            for i, region in enumerate(result.regions):
+                with self.subTest(row=row, region=region.name):
+                    self.assertEqual(bool(result.region_reachable[row, i]), region.can_reach(state))
+
+    def test_start_regions(self):
+        world = self.multiworld.worlds[self.player]
+        matrix, columns = make_inventories([["Swim"], []])
+        result = evaluate(world, matrix, columns, start_regions=["Mystic Lake - Entrance"], sweep=False)
+        shallows = result.can_reach_region("Mystic Lake - Shallows")
+        self.assertTrue(shallows[0])
+        self.assertFalse(shallows[1])
+
+    def test_precollected_items_outside_columns(self):
+        world = self.multiworld.worlds[self.player]
+        self.multiworld.push_precollected(self._create_items("Swim", self.player))
+        matrix, columns = make_inventories([[]])
+        self.assertNotIn("Swim", columns)
+        result = evaluate(world, matrix, columns, start_regions=["Mystic Lake - Entrance"], sweep=False)
+        self.assertTrue(result.can_reach_region("Mystic Lake - Shallows")[0])
@@ -0,0 +1,46 @@
+from Options import OptionError
+
+from .. import options
+from ..budget import check_pool_budget, get_pool_budget
+from .bases import WL4TestBase
+
+
+class TestPoolBudget(WL4TestBase):
+    options = {
+        "difficulty": options.Difficulty.option_hard,
+        "diamond_shuffle": True,
+        "goal": options.Goal.option_golden_treasure_hunt,
+    }
+
+    def test_budget_matches_pool(self):
+        world = self.multiworld.worlds[self.player]
+        budget = get_pool_budget(world)
+        pool = [item for item in self.multiworld.itempool if item.player == self.player]
+        self.assertEqual(budget.locations, len(pool))
+        for name, count in budget.items.items():
+            with self.subTest(name):
+                self.assertGreaterEqual(sum(item.name == name for item in pool), count)
+
+
+class TestPoolDeficit(WL4TestBase):
+    options = {
+        "difficulty": options.Difficulty.option_hard,
+        "open_doors": options.OpenDoors.option_off,
+        "keyzer_shuffle": False,
+    }
+
+    def test_too_many_jewel_pieces(self):
+        world = self.multiworld.worlds[self.player]
+        world.options.pool_jewels.value = 4
+        world.options.golden_jewels.value = 2
+        self.assertEqual(get_pool_budget(world).deficit(), 5)
+        with self.assertRaises(OptionError):
+            check_pool_budget(world)
+
+    def test_opened_keyzer_locations_make_space(self):
+        world = self.multiworld.worlds[self.player]
+        world.options.pool_jewels.value = 4
+        world.options.golden_jewels.value = 2
+        world.options.open_doors.value = options.OpenDoors.option_open
+        world.options.keyzer_shuffle.value = True
+        check_pool_budget(world)
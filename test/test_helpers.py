@@ -1,11 +1,27 @@
+import hashlib
 import itertools
-from unittest import TestCase
+import os
+import struct
+import tempfile
+from pathlib import Path
+from unittest import TestCase, mock
+
+from worlds.Files import APTokenTypes
 
 from ..data import Passage
 from ..items import get_jewel_pieces_by_passage
 from ..locations import get_level_locations, location_table
 from ..options import Difficulty
+from ..patcher import find_patches, get_target_path, patch_file, prepare_base_rom
 from ..region_data import LocationType, level_table
+from ..rom import (
+    WL4PatchExtensions,
+    WL4ProcedurePatch,
+    map_rom,
+    read_patched_base_rom,
+    write_patched_base_rom,
+    write_table,
+)
 
 
 main_levels = ["Palm Tree Paradise", "Wildflower Fields", "Mystic Lake", "Monsoon Jungle",
@@ -39,6 +55,152 @@ class TestHelpers(TestCase):
             assert all(map(lambda l: l.startswith("Golden Passage"), checks))
 
 
+class TestWriteTable(TestCase):
+    class Patch:
+        def __init__(self):
+            self.tokens = []
+
+        def write_token(self, token_type, offset, data):
+            self.tokens.append((offset, data))
+
+    def test_runs_are_coalesced(self):
+        patch = self.Patch()
+        write_table(patch, 0x100, 2, {5: b"\x05\x00", 0: b"\x00\x00", 1: b"\x01\x00", 6: b"\x06\x00"})
+        self.assertEqual(patch.tokens, [(0x100, b"\x00\x00\x01\x00"), (0x10A, b"\x05\x00\x06\x00")])
+
+
+class TestPatchExtensions(TestCase):
+    def test_steps_share_buffer(self):
+        rom = bytes(0xA0) + b"WARIOLANDE\0\0" + bytes(0x100)
+        buffer = WL4PatchExtensions.update_header(None, rom)
+        self.assertIsInstance(buffer, bytearray)
+        self.assertEqual(buffer[0xA0:0xAC], b"WARIOLANDAPE")
+
+        buffer = bytearray(rom)
+        self.assertIs(WL4PatchExtensions.update_header(None, buffer), buffer)
+
+    def test_procedure_shares_buffer(self):
+        class Patch:
+            def get_file(self, name):
+                return tokens
+
+        tokens = struct.pack("<I", 6) + b"".join((
+            struct.pack("<BII", APTokenTypes.WRITE, 0x10, 3) + b"abc",
+            struct.pack("<BII", APTokenTypes.COPY, 0x20, 8) + struct.pack("<II", 3, 0x10),
+            struct.pack("<BII", APTokenTypes.RLE, 0x30, 8) + struct.pack("<II", 4, 0xFF),
+            struct.pack("<BII", APTokenTypes.OR_8, 0x30, 1) + b"\x0F",
+            struct.pack("<BII", APTokenTypes.AND_8, 0x31, 1) + b"\x0F",
+            struct.pack("<BII", APTokenTypes.XOR_8, 0x32, 1) + b"\x01",
+        ))
+        rom = bytes(0xA0) + b"WARIOLANDE\0\0" + bytes(0x700000)
+
+        buffer = WL4PatchExtensions.apply_tokens(Patch(), rom, "token_data.bin")
+        self.assertIsInstance(buffer, bytearray)
+        self.assertEqual(buffer[0x10:0x13], b"abc")
+        self.assertEqual(buffer[0x20:0x23], b"abc")
+        self.assertEqual(buffer[0x30:0x35], b"\xFF\x0F\xFE\xFF\x00")
+        self.assertIs(WL4PatchExtensions.update_header(Patch(), buffer), buffer)
+        self.assertIs(WL4PatchExtensions.copy_medal_gfx(Patch(), buffer, 0x100), buffer)
+
+
+class TestPatchedBaseRomCache(TestCase):
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            old_path = Path(directory, "rom-old.gba")
+            path = Path(directory, "rom-new.gba")
+            other_path = Path(directory, "other-old.gba")
+            self.assertIsNone(read_patched_base_rom(path))
+
+            write_patched_base_rom(old_path, "rom", b"old")
+            write_patched_base_rom(other_path, "other", b"other")
+            write_patched_base_rom(path, "rom", b"patched")
+            cached = read_patched_base_rom(path)
+            self.assertEqual(bytes(cached), b"patched")
+            self.assertEqual(bytearray(cached), b"patched")
+            cached.close()
+
+            # Only the entries for the same base ROM are replaced
+            self.assertFalse(old_path.exists())
+            self.assertTrue(other_path.exists())
+
+    def test_bsdiff_on_mapped_rom(self):
+        import bsdiff4
+
+        base = bytes(range(256)) * 64
+        patched = base[:0x1000] + b"patched" + base[0x1007:]
+
+        class Patch:
+            def get_file(self, name):
+                return bsdiff4.diff(base, patched)
+
+        with tempfile.TemporaryDirectory() as directory:
+            rom_path = Path(directory, "base.gba")
+            rom_path.write_bytes(base)
+            cache_path = Path(directory, "cache", "base-patch.gba")
+            with mock.patch(f"{WL4PatchExtensions.__module__}.get_patched_base_rom_path", return_value=cache_path):
+                # Once with an empty cache, then from the cache
+                for _ in range(2):
+                    with map_rom(rom_path) as rom:
+                        self.assertEqual(WL4PatchExtensions.apply_bsdiff4(Patch(), rom, "basepatch.bsdiff"), patched)
+                    self.assertEqual(cache_path.read_bytes(), patched)
+
+
+class TestMapRom(TestCase):
+    def test_md5_follows_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory, "rom.gba")
+            path.write_bytes(b"rom")
+            with map_rom(path) as rom:
+                self.assertEqual(rom[:], b"rom")
+                self.assertEqual(rom.md5, hashlib.md5(b"rom").hexdigest())
+
+            path.write_bytes(b"new rom")
+            os.utime(path, ns=(0, 0))
+            with map_rom(path) as rom:
+                self.assertEqual(rom.md5, hashlib.md5(b"new rom").hexdigest())
+
+
+class TestPatcher(TestCase):
+    def test_find_patches(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ("b.apwl4", "a.apwl4", "a.gba", "c.apsm"):
+                Path(directory, name).touch()
+            patches = find_patches(Path(directory))
+            self.assertEqual([path.name for path in patches], ["a.apwl4", "b.apwl4"])
+            self.assertEqual(get_target_path(patches[0], Path("out")), Path("out", "a.gba"))
+
+    def test_patch_file(self):
+        import bsdiff4
+
+        base = bytes(0xA0) + b"WARIOLANDE\0\0" + bytes(0x100)
+        patched_base = base + bytes(0x800000 - len(base))
+        with tempfile.TemporaryDirectory() as directory:
+            rom_path = Path(directory, "base.gba")
+            rom_path.write_bytes(base)
+            source = Path(directory, "seed.apwl4")
+            patch = WL4ProcedurePatch(player=1, player_name="Player")
+            patch.write_file("basepatch.bsdiff", bsdiff4.diff(base, patched_base))
+            patch.write_token(APTokenTypes.WRITE, 0x1000, b"token")
+            patch.write_file("token_data.bin", patch.get_token_binary())
+            patch.write(str(source))
+
+            module = WL4ProcedurePatch.__module__
+            with mock.patch(f"{module}.get_base_rom_path", return_value=rom_path), \
+                 mock.patch(f"{module}.get_patched_base_rom_path", return_value=Path(directory, "cache.gba")):
+                prepare_base_rom(source)
+                result = patch_file(source, get_target_path(source, Path(directory)))
+                # The patch caches the base ROM on the class, don't leave it to other tests
+                if "source_data" in vars(WL4ProcedurePatch):
+                    WL4ProcedurePatch.source_data.close()
+                    del WL4ProcedurePatch.source_data
+
+            self.assertIsNone(result.error)
+            rom = result.target.read_bytes()
+            self.assertEqual(len(rom), 0x800000)
+            self.assertEqual(rom[0xA0:0xAC], b"WARIOLANDAPE")
+            self.assertEqual(rom[0x1000:0x1005], b"token")
+
+
 class TestLocationExistence(TestCase):
     def _test_locations_match(self, difficulty):
         locations_from_table = {
@@ -0,0 +1,164 @@
+from unittest import TestCase
+
+from BaseClasses import CollectionState
+from worlds.generic.Rules import add_item_rule
+
+from .. import options
+from ..ability_tables import dump_level_tables, load_level_tables, parse_level_tables
+from ..regions import create_level_tables, get_template_key, get_world_template
+from .bases import WL4TestBase
+
+
+class TestWorldTemplates(WL4TestBase):
+    options = {
+        "difficulty": options.Difficulty.option_hard,
+        "diamond_shuffle": True,
+    }
+
+    def test_template_matches_world(self):
+        world = self.multiworld.worlds[self.player]
+        template = get_world_template(world)
+        self.assertEqual(
+            [region.name for region in template.regions],
+            [region.name for region in self.multiworld.get_regions(self.player)]
+        )
+        self.assertEqual(
+            {location.name for region in template.regions for location in region.locations},
+            {location.name for location in self.multiworld.get_locations(self.player)}
+        )
+
+    def test_template_is_shared(self):
+        world = self.multiworld.worlds[self.player]
+        template = get_world_template(world)
+        self.assertIs(get_world_template(world), template)
+
+        key = get_template_key(world)
+        world.options.portal.value = options.Portal.option_open
+        try:
+            self.assertNotEqual(get_template_key(world), key)
+            self.assertIsNot(get_world_template(world), template)
+        finally:
+            world.options.portal.value = options.Portal.option_vanilla
+
+
+class TestCompactLogic(WL4TestBase):
+    options = {
+        "compact_logic": True,
+    }
+
+    def test_one_region_per_level(self):
+        self.assertRaises(KeyError, self.multiworld.get_region, "Mystic Lake - Shallows", self.player)
+        location = self.multiworld.get_location("Mystic Lake - Full Health Item Box", self.player)
+        self.assertEqual(location.parent_region.name, "Mystic Lake - Entrance")
+        self.assertFalse(any(" to " in entrance.name for region in self.multiworld.get_regions(self.player)
+                             for entrance in region.exits))
+
+
+class TestLevelTables(TestCase):
+    def test_shipped_tables_are_current(self):
+        """If this fails, rebuild data/level_tables.json with `python -m worlds.wl4.ability_tables`."""
+        self.assertEqual(load_level_tables(), create_level_tables())
+
+    def test_round_trip(self):
+        tables = create_level_tables()
+        self.assertEqual(parse_level_tables(dump_level_tables(tables)), tables)
+
+
+class TestMergedRegions(WL4TestBase):
+    options = {
+        "difficulty": options.Difficulty.option_s_hard,
+        "logic": options.Logic.option_advanced,
+    }
+
+    def test_open_regions_are_merged(self):
+        """On S-Hard, the Hotel Horror switch room is always open from the room before it."""
+        self.assertRaises(KeyError, self.multiworld.get_region, "Hotel Horror - Switch Room", self.player)
+        switch = self.multiworld.get_location("Hotel Horror - Frog Switch", self.player)
+        self.assertTrue(switch.parent_region.name.startswith("Hotel Horror - "))
+        self.assertTrue(all(entrance.connected_region.name != "Hotel Horror - Switch Room"
+                            for region in self.multiworld.get_regions(self.player)
+                            for entrance in region.exits))
+
+
+class TestKeyzerPlacement(WL4TestBase):
+    options = {
+        "difficulty": options.Difficulty.option_s_hard,
+        "keyzer_shuffle": True,
+    }
+
+    def test_keyzers_in_own_level(self):
+        world = self.multiworld.worlds[self.player]
+        for level in world.levels.values():
+            for item in level.items:
+                if item.name.startswith("Keyzer"):
+                    with self.subTest(item.name):
+                        self.assertIsNotNone(item.location)
+                        self.assertEqual(
+                            (item.location.passage, item.location.level),
+                            (item.data.passage, item.data.level)
+                        )
+
+    def test_fallback_fill(self):
+        world = self.multiworld.worlds[self.player]
+        keyzers = [item for level in world.levels.values() for item in level.items if item.name.startswith("Keyzer")]
+        self.assertTrue(keyzers)
+        for item in keyzers:
+            item.location.item = None
+            item.location.locked = False
+            item.location = None
+
+        state = CollectionState(self.multiworld)
+        for item in self.multiworld.itempool:
+            state.collect(item, True)
+        state.sweep_for_advancements()
+        world.fill_remaining_keyzers(state)
+        for item in keyzers:
+            with self.subTest(item.name):
+                self.assertEqual((item.location.passage, item.location.level), (item.data.passage, item.data.level))
+
+    def test_fallback_keeps_item_rules(self):
+        world = self.multiworld.worlds[self.player]
+        level = next(level for level in world.levels.values()
+                     if any(item.name.startswith("Keyzer") for item in level.items))
+        keyzer = next(item for item in level.items if item.name.startswith("Keyzer"))
+        keyzer.location.item = None
+        keyzer.location.locked = False
+        keyzer.location = None
+
+        # Like the local and non-local items rules core adds before pre_fill
+        location = next(location for location in level.locations if location.item is None)
+        add_item_rule(location, lambda item: item.name != keyzer.name)
+        old_rule = location.item_rule
+
+        state = CollectionState(self.multiworld)
+        for item in self.multiworld.itempool:
+            state.collect(item, True)
+        state.sweep_for_advancements()
+        world.fill_remaining_keyzers(state)
+        self.assertIsNot(keyzer.location, location)
+        self.assertIs(location.item_rule, old_rule)
+        self.assertFalse(location.item_rule(keyzer))
+
+
+class TestAllowedItems(WL4TestBase):
+    options = {
+        "goal": options.Goal.option_golden_treasure_hunt,
+        "restrict_self_locking_jewel_pieces": True,
+    }
+
+    def test_boss_prizes(self):
+        world = self.multiworld.worlds[self.player]
+        location = self.multiworld.get_location("Cractus - 0:15", self.player)
+        self.assertFalse(location.item_rule(world.create_item("Top Right Emerald Piece")))
+        self.assertTrue(location.item_rule(world.create_item("Top Right Ruby Piece")))
+        self.assertTrue(location.item_rule(world.create_item("Swim")))
+
+        other_player = world.create_item("Top Right Emerald Piece")
+        other_player.player = self.player + 1
+        self.assertTrue(location.item_rule(other_player))
+
+    def test_golden_passage(self):
+        world = self.multiworld.worlds[self.player]
+        location = self.multiworld.get_location("Golden Passage - River Box", self.player)
+        self.assertFalse(location.item_rule(world.create_item("Top Right Sapphire Piece")))
+        self.assertTrue(location.item_rule(world.create_item("Top Right Golden Jewel Piece")))
@@ -0,0 +1,283 @@
+import json
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from BaseClasses import CollectionState
+from Options import OptionError
+
+from .. import options
+from ..data import Passage
+from ..items import get_jewel_pieces_by_passage
+from ..options import Difficulty
+from ..profiling import PROFILE_ENVIRONMENT_VARIABLE, RuleProfiler, Telemetry, write_telemetry
+from ..region_data import level_table
+from ..rules import (
+    FALSE,
+    TRUE,
+    All,
+    Any,
+    Has,
+    advanced_logic,
+    difficulty,
+    has,
+    has_all,
+    has_any,
+    has_jewels,
+    inventory_layout,
+    not_difficulty,
+    treasure_count,
+)
+from ..trick_names import trick_names
+from ..tricks import trick_table
+from .bases import WL4TestBase
+
+
+class TestRequirementSimplification(TestCase):
+    def test_interning(self):
+        """Equal rules built separately should be the same object."""
+        self.assertIs(has_all(["Grab", "Swim"]), has_all(["Grab", "Swim"]))
+        self.assertIs(has("Grab") | advanced_logic(), has("Grab") | advanced_logic())
+
+    def test_flattening(self):
+        rule = has("Grab") & (has("Swim") & has("Head Smash"))
+        self.assertEqual(rule, All((has("Grab"), has("Swim"), has("Head Smash"))))
+        rule = has("Grab") | (has("Swim") | has("Head Smash"))
+        self.assertEqual(rule, Any((has("Grab"), has("Swim"), has("Head Smash"))))
+
+    def test_duplicates(self):
+        self.assertIs(has("Grab") & has("Grab"), has("Grab"))
+        self.assertIs(has_any(["Swim", "Swim"]), has("Swim"))
+
+    def test_absorption(self):
+        self.assertIs(has("Grab") | (has("Grab") & has("Swim")), has("Grab"))
+        self.assertIs(has("Grab") & (has("Grab") | has("Swim")), has("Grab"))
+        self.assertIs(has("Grab") | has("Heavy Grab"), has("Grab"))
+        self.assertIs(has("Grab") & has("Heavy Grab"), has("Heavy Grab"))
+
+    def test_difficulty_merging(self):
+        self.assertIs(difficulty(Difficulty.option_normal) | not_difficulty(Difficulty.option_normal), TRUE)
+        self.assertIs(difficulty(Difficulty.option_normal) & difficulty(Difficulty.option_hard), FALSE)
+        self.assertIs(difficulty(Difficulty.option_hard) | difficulty(Difficulty.option_s_hard),
+                      not_difficulty(Difficulty.option_normal))
+
+    def test_unfolded_nodes_dont_compile(self):
+        for rule in (difficulty(Difficulty.option_hard), advanced_logic()):
+            with self.subTest(str(rule)):
+                self.assertRaises(TypeError, rule.compile, None)
+
+    def test_constants(self):
+        self.assertIs(has("Grab") & TRUE, has("Grab"))
+        self.assertIs(has("Grab") | FALSE, has("Grab"))
+        self.assertIs(has("Grab") & FALSE, FALSE)
+        self.assertIs(has("Grab") | TRUE, TRUE)
+
+    def test_helpers_resolve(self):
+        self.assertEqual(has("Super Ground Pound"), Has("Progressive Ground Pound", 2))
+
+    def test_region_data_rules_are_interned(self):
+        """Every rule in the level table should come from the intern table, so shared rules are shared objects."""
+        rules = [
+            rule
+            for level in level_table.values()
+            for region in level.regions
+            for rule in [*(exit.access_rule for exit in region.exits),
+                         *(location.access_rule for location in region.locations)]
+            if rule is not None
+        ]
+        self.assertEqual(len({id(rule) for rule in rules}), len(set(rules)))
+
+
+class TestRuleIndex(WL4TestBase):
+    options = {
+        "open_doors": options.OpenDoors.option_off,
+        "keyzer_shuffle": False,
+    }
+
+    def test_index_contains_rules(self):
+        world = self.multiworld.worlds[self.player]
+        spots = world.rule_index.spots
+        self.assertIn(self.multiworld.get_entrance("Wildflower Fields - Entrance to 8-Shaped Cave", self.player),
+                      spots["Progressive Ground Pound"])
+        self.assertIn(self.multiworld.get_entrance("Golden Pyramid Entrance", self.player),
+                      spots["Ruby Passage Clear"])
+        self.assertIn(self.multiworld.get_entrance("The Big Board Entrance", self.player),
+                      spots["Keyzer (Topaz Passage 1)"])
+        self.assertIn(self.multiworld.get_location("Hall of Hieroglyphs - Full Health Item Box", self.player),
+                      spots["Escape Hall of Hieroglyphs"])
+
+    def test_cached_results_are_invalidated(self):
+        entrance = self.multiworld.get_entrance("Mystic Lake - Entrance to Shallows", self.player)
+        state = CollectionState(self.multiworld)
+        self.assertFalse(entrance.access_rule(state))
+        state.collect(self._create_items("Swim", self.player), True)
+        self.assertTrue(entrance.access_rule(state))
+        copy = state.copy()
+        copy.remove(self._create_items("Swim", self.player))
+        self.assertFalse(entrance.access_rule(copy))
+        self.assertTrue(entrance.access_rule(state))
+
+    def test_shared_rules_are_cached_once(self):
+        """Spots with the same requirement should share a cached result."""
+        world = self.multiworld.worlds[self.player]
+        state = CollectionState(self.multiworld)
+        for spot in world.rule_index.requirements:
+            spot.access_rule(state)
+        distinct = {requirement for requirement in world.rule_index.requirements.values()} - {TRUE, FALSE}
+        self.assertEqual(len(state.wl4_rule_results[self.player]), len(distinct))
+        self.assertLess(len(distinct), len(world.rule_index.requirements))
+
+    def test_rules_outside_spots_are_invalidated(self):
+        world = self.multiworld.worlds[self.player]
+        items = ["Swim", "Head Smash", "Dash Attack", "Stomp Jump"]
+        requirement = has_all(items)
+        self.assertNotIn(requirement, world.rule_index.requirements.values())
+        rule = requirement.apply_world(world)
+
+        state = CollectionState(self.multiworld)
+        self.assertFalse(rule(state))
+        for item in items:
+            state.collect(self._create_items(item, self.player), True)
+        self.assertTrue(rule(state))
+        state.remove(self._create_items("Swim", self.player))
+        self.assertFalse(rule(state))
+
+
+class TestRuleProfiler(WL4TestBase):
+    def test_profiler_counts_calls(self):
+        world = self.multiworld.worlds[self.player]
+        entrance = self.multiworld.get_entrance("Mystic Lake - Entrance to Shallows", self.player)
+        requirement = world.rule_index.requirements[entrance]
+        profiler = RuleProfiler()
+        rule = requirement.bind(world, profiler.add(entrance, requirement))
+
+        state = CollectionState(self.multiworld)
+        self.assertFalse(rule(state))
+        state.collect(self._create_items("Swim", self.player), True)
+        self.assertTrue(rule(state))
+        self.assertTrue(rule(state))
+
+        stats, = profiler.stats
+        self.assertEqual((stats.hits, stats.misses), (1, 2))
+        self.assertEqual(stats.true, 2)
+        self.assertEqual(stats.spot, "Mystic Lake - Entrance to Shallows")
+        self.assertIn("Mystic Lake - Entrance to Shallows", profiler.report())
+
+    def test_report_per_multiworld(self):
+        world = self.multiworld.worlds[self.player]
+        world.rule_profiler = RuleProfiler()
+        entrance = self.multiworld.get_entrance("Mystic Lake - Entrance to Shallows", self.player)
+        world.rule_profiler.add(entrance, world.rule_index.requirements[entrance])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "profile.txt")
+            with mock.patch.dict(os.environ, {PROFILE_ENVIRONMENT_VARIABLE: path}):
+                type(world).stage_generate_output(self.multiworld, directory)
+            with open(path, encoding="utf-8") as file:
+                report = file.read()
+        self.assertIn(f"{world.player_name} (player {world.player}", report)
+        self.assertIn("Mystic Lake - Entrance to Shallows", report)
+
+
+class TestTelemetry(WL4TestBase):
+    def test_records_are_json_lines(self):
+        world = self.multiworld.worlds[self.player]
+        telemetry = Telemetry()
+        with telemetry.span("create_items"):
+            telemetry.count("tokens", 2)
+        telemetry.count("tokens")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "telemetry.jsonl")
+            write_telemetry(path, world, telemetry)
+            write_telemetry(path, world, telemetry)
+            with open(path, encoding="utf-8") as file:
+                records = [json.loads(line) for line in file]
+
+        self.assertEqual(len(records), 2)
+        record = records[0]
+        self.assertEqual(record["player"], self.player)
+        self.assertEqual(record["game"], world.game)
+        self.assertEqual(record["counters"], {"tokens": 3})
+        self.assertIn("create_items", record["spans"])
+
+
+class TestInventoryLayout(WL4TestBase):
+    def test_inventory_tracks_counts(self):
+        state = CollectionState(self.multiworld)
+        ground_pound = self._create_items("Progressive Ground Pound", self.player)
+        super_ground_pound = has("Super Ground Pound").apply_world(self.multiworld.worlds[self.player])
+
+        state.collect(ground_pound, True)
+        self.assertFalse(super_ground_pound(state))
+        state.collect(ground_pound, True)
+        self.assertTrue(super_ground_pound(state))
+        state.collect(ground_pound, True)
+        state.remove(ground_pound)
+        self.assertTrue(super_ground_pound(state))
+        state.remove(ground_pound)
+        self.assertFalse(super_ground_pound(state))
+
+    def test_every_rule_item_is_packed(self):
+        for item in self.multiworld.worlds[self.player].rule_index.rules:
+            with self.subTest(item=item):
+                self.assertIn(item, inventory_layout.fields)
+
+
+class TestAggregateCounters(WL4TestBase):
+    options = {
+        "goal": options.Goal.option_golden_treasure_hunt,
+    }
+
+    def test_treasure_count(self):
+        state = CollectionState(self.multiworld)
+        state.collect(self._create_items("Golden Apple", self.player), True)
+        state.collect(self._create_items("Golden Apple", self.player), True)
+        state.collect(self._create_items("Golden Robot", self.player), True)
+        self.assertEqual(treasure_count(state, self.player), 2)
+        state.remove(self._create_items("Golden Apple", self.player))
+        self.assertEqual(treasure_count(state, self.player), 2)
+        state.remove(self._create_items("Golden Apple", self.player))
+        self.assertEqual(treasure_count(state, self.player), 1)
+
+    def test_jewel_sets(self):
+        world = self.multiworld.worlds[self.player]
+        two_emeralds = has_jewels(Passage.EMERALD, 2).apply_world(world)
+        state = CollectionState(self.multiworld)
+        for piece in get_jewel_pieces_by_passage(Passage.EMERALD):
+            state.collect(self._create_items(piece, self.player), True)
+        self.assertFalse(two_emeralds(state))
+        for piece in get_jewel_pieces_by_passage(Passage.EMERALD):
+            state.collect(self._create_items(piece, self.player), True)
+        self.assertTrue(two_emeralds(state))
+        state.remove(self._create_items("Top Left Emerald Piece", self.player))
+        self.assertFalse(two_emeralds(state))
+
+
+class TestTrickOptions(WL4TestBase):
+    options = {
+        "logic": options.Logic.option_basic,
+        "enabled_tricks": {"Throws"},
+        "disabled_tricks": {"MJ CD box with grab"},
+    }
+
+    def test_enabled_tricks(self):
+        world = self.multiworld.worlds[self.player]
+        self.assertIn("MJ with grab", world.enabled_tricks)
+        self.assertIn("AN Onomi room with grab", world.enabled_tricks)
+        self.assertNotIn("MJ CD box with grab", world.enabled_tricks)
+        self.assertNotIn("GP current room skip", world.enabled_tricks)
+
+    def test_trick_options_verify(self):
+        world = self.multiworld.worlds[self.player]
+        world.options.enabled_tricks.verify_keys()
+        world.options.disabled_tricks.verify_keys()
+        self.assertRaises(OptionError, options.EnabledTricks({"Not a trick"}).verify_keys)
+
+    def test_trick_names_match_rules(self):
+        self.assertEqual(trick_names, trick_table.keys())
+
+    def test_tricks_fold_to_constants(self):
+        requirements = self.multiworld.worlds[self.player].rule_index.requirements
+        deeps = self.multiworld.get_entrance("Monsoon Jungle - Entrance to Deeps", self.player)
+        cd_box = self.multiworld.get_location("Monsoon Jungle - CD Box", self.player)
+        self.assertIs(requirements[deeps], has("Ground Pound") | has("Grab"))
+        self.assertIs(requirements[cd_box], has("Ground Pound") & has("Escape Monsoon Jungle"))
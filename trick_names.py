@@ -0,0 +1,39 @@
+"""
+Every trick's name, by category. The trick options need them when their
+classes are created, and tricks.py can't be imported that early because its
+rules import the options, so the names are kept here.
+"""
+
+
+trick_categories: dict[str, tuple[str, ...]] = {
+    "Throws": (
+        "MJ with grab",
+        "MJ CD box with grab",
+        "40BF CD box with heavy grab",
+        "PZ fruit room without ground pound",
+        "PZ Normal jungle room with Fat Wario",
+        "PZ escape without ground pound",
+        "TBB front with grab",
+        "DW gray square room with grab",
+        "AN Onomi room with grab",
+    ),
+    "Minion Jumps": (
+        "40BF glass ball stomp jump",
+        "PZ Normal jungle room with minion jump",
+        "TBB bouncy room alcove with minion jumps",
+        "HH escape minion jump",
+    ),
+    "Precise Movement": (
+        "TTL transformation puzzle without heavy grab",
+        "DR switch room block no dash attack",
+        "Catbat without stomp jump",
+        "GP current room skip",
+        "GP Keyzer puzzle without ground pound",
+    ),
+    "Damage Boosts": (
+        "DR toy car tower diamond damage boost",
+        "DR escape with only swim",
+    ),
+}
+
+trick_names = frozenset(name for names in trick_categories.values() for name in names)
@@ -1,22 +1,41 @@
-from typing import NamedTuple
+from __future__ import annotations
 
-from .options import Difficulty
-from .rules import *
+from typing import Iterable, NamedTuple, TYPE_CHECKING
 
+from .options import Difficulty, Logic
+from .rules import *
+from .trick_names import trick_categories
 
-# Eventually, the goal is to allow opting in and out of certain tricks rather than the all-or-nothing system we have now
+if TYPE_CHECKING:
+    from .options import WL4Options
 
 
 class TrickData(NamedTuple):
     rule: Requirement | None
-    # TODO: Categories, difficulties?
+    # TODO: Difficulties?
 
 
 def trick(name: str):
     rule = trick_table[name].rule
     if rule is None:
-        return advanced_logic()
-    return advanced_logic() & rule
+        return advanced_logic(name)
+    return advanced_logic(name) & rule
+
+
+def expand_tricks(names: Iterable[str]) -> set[str]:
+    """Replace any categories in `names` with the tricks in them."""
+    return {
+        trick_name
+        for name in names
+        for trick_name in (trick_categories[name] if name in trick_categories else (name,))
+    }
+
+
+def get_enabled_tricks(options: WL4Options) -> frozenset[str]:
+    enabled = set(trick_table) if options.logic.value == Logic.option_advanced else set()
+    enabled |= expand_tricks(options.enabled_tricks.value)
+    enabled -= expand_tricks(options.disabled_tricks.value)
+    return frozenset(enabled)
 
 
 trick_table = {
@@ -83,7 +102,7 @@ trick_table = {
 
     # Access the switch on hard by throwing the Marumen upward, stomping it in midair, and starting a ground pound.
     "HH escape minion jump": TrickData(
-        difficulty(Difficulty.option_hard) & has_all(["Grab", "Stomp Jump", "Super Ground Pound"])
+        difficulty(Difficulty.option_hard) & has_all(["Grab", "Stomp Jump", "Super Ground Pound"]),
     ),
 
     # To jump off the waves, start walking before you jump. When the waves start oscillating, jump at the apex.
@@ -98,3 +117,4 @@ trick_table = {
     # Cractus and Catbat
     "GP Keyzer puzzle without ground pound": TrickData(has("Grab")),
 }
+